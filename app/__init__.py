@@ -4,7 +4,9 @@ __version__ = '0.3.0'
 
 def make_application():
     from flask import Flask
+    from app.aws import snapshot_store
     from app.config import Config
+    from app.encoding import use_encoder
     import app.views
 
     flask_app = Flask(__name__, static_url_path='')
@@ -19,8 +21,13 @@ def make_application():
         sentry = Sentry()
         sentry.init_app(flask_app, dsn=Config.SENTRY_DSN)
 
+    use_encoder(Config.JSON_ENCODER)
+
     flask_app.config.from_object('app.config.Config')
     flask_app.register_blueprint(app.views.blueprint_http)
     app.views.blueprint_http.config = flask_app.config
 
+    if Config.SNAPSHOT_BACKGROUND_REFRESH:
+        snapshot_store.start(Config.AWS_REGIONS)
+
     return flask_app
@@ -1,50 +1,128 @@
 import gevent.monkey
 gevent.monkey.patch_all()  # noqa
 
-import boto3
 import datetime
+import functools
+import gevent
+import gevent.pool
+import itertools
 import json
-import lru
+import random
 
 from botocore import BOTOCORE_ROOT
+from botocore.exceptions import ClientError
 from inflection import underscore
 
+from app.cache import cache_function
 from app.config import Config
-from app.filters import filter_elements
+from app.fanout import fan_out
+from app.filters import FilteredElements
+from app.filters import compile_filters
 from app.log import getLogger
+from app.pool import ResourcePool
+from app.records import project
+from app.snapshots import SharedSnapshots
+from app.snapshots import SnapshotStore
+from app.snapshots import describe_error
 from app.utils import sorted_dict
 from app.utils import to_bool
 
 
 logger = getLogger('haldane')
+resource_pool = ResourcePool()
 
+THROTTLING_ERROR_CODES = [
+    'RequestLimitExceeded',
+    'Throttling',
+    'ThrottlingException',
+]
 
-def get_amis(request_args, regions, query=None):
-    amis = []
-    for region in regions:
-        ec2_resource = boto3.resource('ec2', region_name=region)
-        amis.extend(get_amis_in_region(ec2_resource, region))
 
-    return filter_elements(amis, request_args, query=query)
+def get_amis(request_args, regions, query=None):
+    snapshots, meta = get_snapshots('amis', regions)
+    return filter_snapshots(snapshots, request_args, query=query), meta
 
 
 def get_nodes(request_args, regions, query=None, status=None):
-    nodes = []
-    for region in regions:
-        nodes.extend(get_nodes_in_region(region))
-
-    return filter_elements(nodes, request_args, query=query, status=status)
+    snapshots, meta = get_snapshots('nodes', regions)
+    return filter_snapshots(snapshots, request_args, query=query), meta
 
 
 def get_rds_instances(request_args, regions, query=None, status=None):
-    rds_instances = []
-    for region in regions:
-        rds_instances.extend(get_rds_instances_in_region(region))
+    snapshots, meta = get_snapshots('rds-instances', regions)
+    return filter_snapshots(snapshots, request_args, query=query), meta
+
+
+def get_snapshots(resource, regions):
+    """Returns the snapshots of ``resource`` in ``regions`` along with meta
+    on their age and any failure to refresh them
+
+    A region without a snapshot to serve is left out and its error reported
+    in ``snapshot_errors``, so that it does not fail the whole request - as
+    long as any region can be served.
+    """
+    results, timings = fan_out(
+        functools.partial(snapshot_store.get, resource),
+        regions,
+        return_exceptions=True)
+
+    snapshots = []
+    errors = {}
+    for region, result in zip(regions, results):
+        if isinstance(result, Exception):
+            errors[region] = describe_error(result)
+            continue
+        snapshots.append(result)
+        error = snapshot_store.error(resource, region)
+        if error is not None:
+            errors[region] = error
+
+    if results and not snapshots:
+        raise results[0]
+
+    return snapshots, {
+        'region_timings': timings,
+        'snapshot_ages': dict((snapshot.region, snapshot.age)
+                              for snapshot in snapshots),
+        'snapshot_errors': errors,
+    }
+
 
-    return filter_elements(rds_instances,
-                           request_args,
-                           query=query,
-                           status=status)
+def refresh_snapshots(resources, regions):
+    """Fetches the snapshots of ``resources`` in ``regions`` anew, whatever
+    their age, and returns the state of each - which holds the error of any
+    that failed to refresh and keeps being served from its last snapshot
+
+    Resources are refreshed in sorted order, so that amis are refreshed
+    before the nodes that take their image names from them.
+    """
+    def refresh(resource, region):
+        try:
+            snapshot_store.refresh(resource, region, force=True)
+        except Exception:
+            logger.exception('unable to refresh {0} in {1}'.format(
+                resource, region))
+        return snapshot_store.state(resource, region)
+
+    states = {}
+    for resource in sorted(resources):
+        results, timings = fan_out(functools.partial(refresh, resource),
+                                   regions)
+        states[resource] = dict(zip(regions, results))
+    return states
+
+
+def get_resources(resource=None):
+    if resource is None:
+        return sorted(snapshot_store.fetchers)
+    if resource not in snapshot_store.fetchers:
+        raise LookupError('Invalid resource querystring argument passed')
+    return [resource]
+
+
+def filter_snapshots(snapshots, request_args, query=None):
+    return FilteredElements(compile_filters(request_args, query=query),
+                            snapshots)
 
 
 def get_regions(region=None):
@@ -58,10 +136,20 @@ def get_regions(region=None):
     return regions
 
 
-@lru.lru_cache_function(
-    max_size=Config.CACHE_SIZE,
-    expiration=Config.CACHE_EXPIRATION)
-def get_amis_in_region(resource, region):
+def get_amis_in_region(region):
+    return snapshot_store.get('amis', region).records
+
+
+def get_amis_by_id_in_region(region):
+    return snapshot_store.get('amis', region).index_by('id')
+
+
+def fetch_amis_in_region(region):
+    with resource_pool.resource('ec2', region) as ec2_resource:
+        return _fetch_amis_in_region(ec2_resource, region)
+
+
+def _fetch_amis_in_region(resource, region):
     amis = []
     for image in resource.images.filter(Owners=['self']).all():
         ami = {
@@ -125,17 +213,14 @@ def get_amis_in_region(resource, region):
     return amis
 
 
-@lru.lru_cache_function(
-    max_size=Config.CACHE_SIZE,
-    expiration=Config.CACHE_EXPIRATION)
-def get_elastic_ips(ec2_resource):
-    classic_addresses = ec2_resource.classic_addresses.all()
-    return [address.public_ip for address in classic_addresses]
+@cache_function()
+def get_elastic_ips(region):
+    with resource_pool.resource('ec2', region) as ec2_resource:
+        classic_addresses = ec2_resource.classic_addresses.all()
+        return frozenset(address.public_ip for address in classic_addresses)
 
 
-@lru.lru_cache_function(
-    max_size=Config.CACHE_SIZE,
-    expiration=Config.CACHE_EXPIRATION)
+@cache_function()
 def get_instance_types(version=None):
     if version is None:
         version = Config.AWS_API_VERSION
@@ -146,14 +231,19 @@ def get_instance_types(version=None):
     return [], version
 
 
-@lru.lru_cache_function(
-    max_size=Config.CACHE_SIZE,
-    expiration=Config.CACHE_EXPIRATION)
 def get_nodes_in_region(region):
-    ec2_resource = boto3.resource('ec2', region_name=region)
-    elastic_ips = get_elastic_ips(ec2_resource)
-    images = get_amis_in_region(ec2_resource, region)
+    return snapshot_store.get('nodes', region).records
+
+
+def fetch_nodes_in_region(region):
+    elastic_ips = get_elastic_ips(region)
+    images = get_amis_by_id_in_region(region)
 
+    with resource_pool.resource('ec2', region) as ec2_resource:
+        return _fetch_nodes_in_region(ec2_resource, region, elastic_ips, images)
+
+
+def _fetch_nodes_in_region(ec2_resource, region, elastic_ips, images):
     instances = []
     instances_for_region = ec2_resource.instances.all()
     for instance in instances_for_region:
@@ -194,11 +284,8 @@ def get_nodes_in_region(region):
 
         instance_name = name.replace('_', '-').strip()
 
-        image_name = [image['name'] for image in images if image['id'] == instance.image_id]
-        if len(image_name) == 1:
-            image_name = image_name[0]
-        else:
-            image_name = ''
+        image = images.get(instance.image_id)
+        image_name = image['name'] if image else ''
 
         instance_profile_id = None
         instance_profile_name = None
@@ -237,11 +324,16 @@ def get_nodes_in_region(region):
     return instances
 
 
-@lru.lru_cache_function(
-    max_size=Config.CACHE_SIZE,
-    expiration=Config.CACHE_EXPIRATION)
 def get_rds_instances_in_region(region):
-    client = boto3.client('rds', region_name=region)
+    return snapshot_store.get('rds-instances', region).records
+
+
+def fetch_rds_instances_in_region(region):
+    with resource_pool.client('rds', region) as client:
+        return _fetch_rds_instances_in_region(client, region)
+
+
+def _fetch_rds_instances_in_region(client, region):
     paginator = client.get_paginator('describe_db_instances')
     page_iterator = paginator.paginate()
 
@@ -260,33 +352,94 @@ def get_rds_instances_in_region(region):
             for key, value in data.items():
                 rds_instance[underscore(key)] = transform_value(value)
 
-            response = client.list_tags_for_resource(ResourceName=rds_instance['db_instance_arn'])
-            rds_instance['tags'] = dict((tag['Key'], tag['Value']) for tag in response['TagList'])
-
             rds_instances.append(rds_instance)
 
+    arns = [instance['db_instance_arn'] for instance in rds_instances]
+    tags = get_rds_tags(region, arns)
+    for rds_instance in rds_instances:
+        rds_instance['tags'] = tags.get(rds_instance['db_instance_arn'], {})
+
     return rds_instances
 
 
+def get_rds_tags(region, arns):
+    if not arns:
+        return {}
+
+    if Config.RDS_TAG_STRATEGY == 'tagging-api':
+        try:
+            with resource_pool.client('resourcegroupstaggingapi', region) as client:
+                return _get_rds_tags_from_tagging_api(client)
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'AccessDeniedException':
+                raise
+            logger.warning('unable to use the tagging api in {0}, falling back to per-instance tag retrieval: {1}'.format(  # noqa
+                region, e))
+
+    def get_tags(arn):
+        with resource_pool.client('rds', region) as client:
+            return _get_rds_tags_for_instance(client, arn)
+
+    pool = gevent.pool.Pool(Config.RDS_TAG_CONCURRENCY)
+    return dict(zip(arns, pool.map(get_tags, arns)))
+
+
+def _get_rds_tags_from_tagging_api(client):
+    tags = {}
+    paginator = client.get_paginator('get_resources')
+    for page in paginator.paginate(ResourceTypeFilters=['rds:db']):
+        for mapping in page['ResourceTagMappingList']:
+            tags[mapping['ResourceARN']] = dict(
+                (tag['Key'], tag['Value']) for tag in mapping['Tags'])
+    return tags
+
+
+def _get_rds_tags_for_instance(client, arn, retries=None, backoff=None):
+    if retries is None:
+        retries = Config.RDS_TAG_RETRIES
+    if backoff is None:
+        backoff = Config.RDS_TAG_BACKOFF
+
+    attempt = 0
+    while True:
+        try:
+            response = client.list_tags_for_resource(ResourceName=arn)
+            break
+        except ClientError as e:
+            code = e.response['Error']['Code']
+            if code not in THROTTLING_ERROR_CODES or attempt >= retries:
+                raise
+            gevent.sleep(backoff * (2 ** attempt) * random.uniform(0.5, 1.5))
+            attempt += 1
+
+    return dict((tag['Key'], tag['Value']) for tag in response['TagList'])
+
+
+snapshot_store = SnapshotStore({
+    'amis': fetch_amis_in_region,
+    'nodes': fetch_nodes_in_region,
+    'rds-instances': fetch_rds_instances_in_region,
+}, shared=SharedSnapshots(Config.SNAPSHOT_DIR) if Config.SNAPSHOT_DIR else None)
+
+
 def format_elements(elements, fields=None, format=None):
-    if fields:
+    """Shapes filtered records into a response body
+
+    Records are never modified, since they belong to a shared snapshot.
+    When ``fields`` are requested, a projection holding just those fields
+    is built per record; otherwise the records themselves are returned.
+    The csv format selects its own columns, so its records are never
+    projected.
+    """
+    if fields and format != 'csv':
         fields = fields.split(',')
-        _elements = []
-        for element in elements:
-            _element = {}
-            if format != 'list':
-                _element['id'] = element['id']
-                _element['name'] = element['name']
-            for field in fields:
-                if field in element:
-                    _element[field] = element.get(field)
-            _elements.append(_element)
-        elements = _elements
-    if format == 'list':
-        return elements
-
-    if fields is None:
-        fields = []
+    else:
+        fields = None
+
+    if format in ['list', 'ndjson']:
+        if fields:
+            return [project(element, fields) for element in elements]
+        return list(elements)
 
     _elements = {}
     for element in elements:
@@ -310,45 +463,63 @@ def format_elements(elements, fields=None, format=None):
 
         _elements[name] = element
 
-    elements = _elements
-    _elements = {}
-    for name, element in elements.items():
-        if fields and 'name' not in fields:
-            del element['name']
-        if fields and 'id' not in fields:
-            del element['id']
-        _elements[name] = element
+    if fields:
+        for name, element in _elements.items():
+            _elements[name] = project(element, fields)
 
     return sorted_dict(_elements)
 
 
-def limit_elements(elements, limit=None):
-    if limit is None:
-        return elements
+def page_elements(elements, limit, after=None, count=True):
+    """Takes a page of up to ``limit`` elements off of a ``FilteredElements``
 
-    count = 0
-    limit = int(limit)
-    _elements = []
-    for element in elements:
-        if count == limit:
-            break
+    Pages follow the order of ``FilteredElements.iter_ordered``, starting
+    after the ``(region, id)`` pair ``after``. Returns the page, the total
+    number of matching elements across all pages and the ``(region, id)``
+    pair the next page starts after, or ``None`` on the last page.
 
-        count += 1
-        _elements.append(element)
-    return _elements
+    When ``count`` is false, the total is only an estimate, unless the page
+    holds every matching element.
+    """
+    limit = int(limit)
+    iterator = elements.iter_ordered('id', after=after)
+    _elements = list(itertools.islice(iterator, limit + 1))
+
+    first_page = after is None
+    last_page = len(_elements) <= limit
+    after = None
+    if not last_page:
+        _elements = _elements[:limit]
+        if _elements:
+            after = (_elements[-1]['region'], _elements[-1]['id'])
+
+    if count:
+        total = sum(1 for _ in elements)
+    elif first_page and last_page:
+        total = len(_elements)
+    else:
+        total = elements.estimate
+    return _elements, total, after
 
 
 def sort_by_group(nodes, group=None):
     groups = {
         'None': []
     }
-    for node in nodes:
-        if node.get('group') is None:
-            groups['None'].append(node)
-        else:
-            if node.get('group') not in groups:
-                groups[node.get('group')] = []
-            groups[node.get('group')].append(node)
+    if isinstance(nodes, FilteredElements):
+        values = None
+        if group is not None:
+            values = [None, 'None'] if group == 'None' else [group]
+        for value, members in nodes.partition('group', values).items():
+            groups.setdefault('None' if value is None else value, []).extend(members)
+    else:
+        for node in nodes:
+            if node.get('group') is None:
+                groups['None'].append(node)
+            else:
+                if node.get('group') not in groups:
+                    groups[node.get('group')] = []
+                groups[node.get('group')].append(node)
 
     if group is not None:
         if group in groups:
@@ -359,6 +530,19 @@ def sort_by_group(nodes, group=None):
     return groups
 
 
+def count_by_group(nodes, group=None):
+    """Returns the number of nodes in each group, without gathering them"""
+    values = None
+    if group is not None:
+        values = [None, 'None'] if group == 'None' else [group]
+
+    counts = {}
+    for value, count in nodes.partition_counts('group', values).items():
+        value = 'None' if value is None else value
+        counts[value] = counts.get(value, 0) + count
+    return counts
+
+
 def transform_value(data):
     if type(data) == datetime.datetime:
         data = data.strftime('%Y-%m-%dT%H:%M:%S.000Z')
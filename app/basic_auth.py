@@ -16,11 +16,13 @@ def skip_check():
     return len(provided_ips) > 0 and provided_ips[0] in Config.ALLOWED_IPS
 
 
-def check_auth(username, password):
+def check_auth(username, password, authentications=None):
     """This function is called to check if a username /
     password combination is valid.
     """
-    authentications = Config.BASIC_AUTH.split(',')
+    if authentications is None:
+        authentications = Config.BASIC_AUTH
+    authentications = authentications.split(',')
     authentication = '{0}:{1}'.format(username, password)
 
     return authentication in authentications
@@ -34,6 +36,11 @@ def authenticate():
         {'WWW-Authenticate': 'Basic realm="Login Required"'})
 
 
+def forbid():
+    """Sends a 403 response for endpoints that are not enabled"""
+    return Response('This endpoint is not enabled.\n', 403)
+
+
 def requires_auth(f):
     @functools.wraps(f)
     def decorated(*args, **kwargs):
@@ -45,3 +52,23 @@ def requires_auth(f):
             return authenticate()
         return f(*args, **kwargs)
     return decorated
+
+
+def requires_admin_auth(f):
+    """Guards endpoints that act on the service rather than read from it
+
+    They are only enabled when ``ADMIN_AUTH`` is set, and always require one
+    of its user/password combinations, whatever the client's ip.
+    """
+    @functools.wraps(f)
+    def decorated(*args, **kwargs):
+        if not Config.ADMIN_AUTH:
+            return forbid()
+
+        auth = request.authorization
+        if not auth or not check_auth(auth.username,
+                                      auth.password,
+                                      Config.ADMIN_AUTH):
+            return authenticate()
+        return f(*args, **kwargs)
+    return decorated
@@ -0,0 +1,181 @@
+import gevent.monkey
+gevent.monkey.patch_all()  # noqa
+
+import collections
+
+import gevent.event
+import lru
+
+from app.config import Config
+
+
+cached_functions = {}
+
+
+class SingleFlight(object):
+    """Collapses concurrent calls for the same key into a single call
+
+    The first caller for a key runs the function, while callers that arrive
+    before it completes wait on its outcome - value or exception - instead
+    of repeating the work.
+
+    When ``detached``, the function runs in a greenlet of its own that every
+    caller waits on, so that a caller giving up - timing out, say - does not
+    abort the call for the others. The function then runs outside of the
+    caller's context, so it must not rely on the current request.
+    """
+
+    def __init__(self, detached=False):
+        self.detached = detached
+        self.calls = 0
+        self.coalesced = 0
+        self._in_flight = {}
+
+    def do(self, key, func, *args, **kwargs):
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            self.coalesced += 1
+            return in_flight.get()
+
+        in_flight = gevent.event.AsyncResult()
+        self._in_flight[key] = in_flight
+        self.calls += 1
+        if self.detached:
+            gevent.spawn(self._call, key, in_flight, func, args, kwargs)
+            return in_flight.get()
+        return self._call(key, in_flight, func, args, kwargs, reraise=True)
+
+    def _call(self, key, in_flight, func, args, kwargs, reraise=False):
+        try:
+            value = func(*args, **kwargs)
+        except BaseException as e:
+            in_flight.set_exception(e)
+            if reraise:
+                raise
+            return
+        finally:
+            del self._in_flight[key]
+
+        in_flight.set(value)
+        return value
+
+    def in_flight(self, key):
+        return key in self._in_flight
+
+    def stats(self):
+        return {
+            'calls': self.calls,
+            'coalesced': self.coalesced,
+            'in_flight': len(self._in_flight),
+        }
+
+
+class CachedFunction(lru.LRUCachedFunction):
+    """An ``lru.LRUCachedFunction`` that keeps count of its hits and misses"""
+
+    def __init__(self, function, cache=None):
+        super(CachedFunction, self).__init__(function, cache)
+        self.flight = SingleFlight(detached=True)
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, *args, **kwargs):
+        key = repr((args, kwargs)) + '#' + self.__name__
+        try:
+            value = self.cache[key]
+        except KeyError:
+            self.misses += 1
+            coalesced = self.flight.in_flight(key)
+            value = self.flight.do(key, self.function, *args, **kwargs)
+            if not coalesced:
+                self.cache[key] = value
+            return value
+
+        self.hits += 1
+        return value
+
+    def stats(self):
+        return {
+            'coalesced': self.flight.coalesced,
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': self.cache.size(),
+        }
+
+
+class ResultCache(object):
+    """A least recently used cache of request results
+
+    ``build`` returns a result along with its weight - the number of
+    elements it holds - and the cache is bounded both by its number of
+    entries and by their total weight, so that a handful of huge results
+    cannot pin an unbounded amount of memory. Results heavier than the
+    whole budget are never cached. Concurrent misses for the same key share
+    a single build.
+    """
+
+    def __init__(self, max_size=None, max_weight=None):
+        if max_size is None:
+            max_size = Config.RESULT_CACHE_SIZE
+        if max_weight is None:
+            max_weight = Config.RESULT_CACHE_MAX_ELEMENTS
+        self.max_size = max_size
+        self.max_weight = max_weight
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.flight = SingleFlight()
+        self._entries = collections.OrderedDict()
+
+    def get(self, key, build):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.hits += 1
+            self._entries[key] = entry
+            return entry[0]
+
+        self.misses += 1
+        return self.flight.do(key, self._build, key, build)
+
+    def _build(self, key, build):
+        value, weight = build()
+        if self.max_size > 0 and weight <= self.max_weight:
+            self._entries[key] = (value, weight)
+            self.weight += weight
+            while len(self._entries) > self.max_size or \
+                    self.weight > self.max_weight:
+                _, (_, evicted_weight) = self._entries.popitem(last=False)
+                self.weight -= evicted_weight
+                self.evictions += 1
+        return value
+
+    def stats(self):
+        requests = self.hits + self.misses
+        return {
+            'coalesced': self.flight.coalesced,
+            'elements': self.weight,
+            'evictions': self.evictions,
+            'hit_rate': float(self.hits) / requests if requests else None,
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._entries),
+        }
+
+
+def cache_function(max_size=None, expiration=None):
+    if max_size is None:
+        max_size = Config.CACHE_SIZE
+    if expiration is None:
+        expiration = Config.CACHE_EXPIRATION
+
+    def wrapper(func):
+        cached = CachedFunction(func, lru.LRUCacheDict(max_size, expiration))
+        cached_functions[cached.__name__] = cached
+        return cached
+    return wrapper
+
+
+def cache_stats():
+    return dict((name, cached.stats())
+                for name, cached in cached_functions.items())
@@ -0,0 +1,184 @@
+from app.config import Config
+from app.utils import to_utf8
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+STRING_FILTERS = frozenset([
+    'starts-with',
+    'ends-with',
+    'substring',
+    'not-starts-with',
+    'not-ends-with',
+    'not-substring',
+])
+
+
+def columnar_filters_available():
+    return numpy is not None and Config.COLUMNAR_FILTERS
+
+
+class Column(object):
+    """The values of one attribute or tag of every record of a snapshot, as
+    arrays that predicates are evaluated on all at once
+
+    Strings are kept utf-8 encoded in a byte string array, where prefix,
+    suffix, substring and equality tests give the same answers as on the
+    decoded strings. Everything ``build_test`` checks that is not about a
+    string's content - presence, ``None``, booleans, truthiness - is kept
+    as a boolean array of its own.
+
+    A column is ``mixed`` when it holds values that are neither strings nor
+    ``None``, and ``opaque`` when any of those are truthy. The scan calls
+    string methods on such values, which raises, so the string predicates
+    it would call them for are left to the scan.
+    """
+
+    def __init__(self, records, key, tag=False):
+        count = len(records)
+        self.present = numpy.zeros(count, dtype=bool)
+        self.is_none = numpy.zeros(count, dtype=bool)
+        self.is_true = numpy.zeros(count, dtype=bool)
+        self.is_false = numpy.zeros(count, dtype=bool)
+        self.is_string = numpy.zeros(count, dtype=bool)
+        self.truthy = numpy.zeros(count, dtype=bool)
+        self.mixed = False
+        self.opaque = False
+
+        strings = [''] * count
+        for position, record in enumerate(records):
+            if tag:
+                values = record.get('tags', {})
+            else:
+                values = record
+            if key not in values:
+                continue
+
+            value = values[key]
+            self.present[position] = True
+            if value is None:
+                self.is_none[position] = True
+                continue
+            if value is True:
+                self.is_true[position] = True
+            elif value is False:
+                self.is_false[position] = True
+            if isinstance(value, basestring):
+                self.is_string[position] = True
+                strings[position] = to_utf8(value)
+            else:
+                self.mixed = True
+                self.opaque = self.opaque or bool(value)
+            self.truthy[position] = bool(value)
+
+        self.strings = numpy.array(strings, dtype=bytes)
+
+    def contains(self, value):
+        return numpy.char.find(self.strings, value) >= 0
+
+    def contains_item(self, value):
+        """Returns whether ``value`` is one of the comma-separated items of
+        each string
+        """
+        items = numpy.char.add(numpy.char.add(',', self.strings), ',')
+        return numpy.char.find(items, ',' + value + ',') >= 0
+
+    def equals(self, value):
+        return self.is_string & (self.strings == value)
+
+
+class SnapshotColumns(object):
+    """Evaluates filter predicates over a snapshot's records as boolean masks
+
+    Columns are built on first use and kept for the life of the snapshot.
+    Predicates that cannot be evaluated exactly as ``build_test`` would are
+    left to the scan, which ``FilterPlan`` still runs on the candidates.
+    """
+
+    def __init__(self, records):
+        self.records = records
+        self._columns = {}
+
+    def column(self, key, tag=False):
+        column = self._columns.get((tag, key))
+        if column is None:
+            column = self._columns[(tag, key)] = Column(self.records, key, tag)
+        return column
+
+    def mask(self, predicate):
+        """Returns a boolean array of the records matching ``predicate``, or
+        ``None`` if it has to be tested record by record
+        """
+        filter_name = predicate.filter_name
+        key = predicate.key
+        value = predicate.value
+        tag = predicate.tag
+
+        if filter_name == 'is-null':
+            return self.column(key, tag).is_none
+        if filter_name == 'is-true':
+            return self.column(key, tag).is_true
+        if filter_name == 'is-false':
+            return self.column(key, tag).is_false
+
+        if not isinstance(value, basestring):
+            return None
+        value = to_utf8(value)
+
+        if filter_name == 'exact':
+            if key == 'elastic_ip' and not tag:
+                return None
+            column = self.column(key, tag)
+            mask = column.equals(value)
+            if not tag and not value:
+                mask |= ~column.present
+            return mask
+
+        if filter_name in ('in-list', 'not-in-list'):
+            column = self.column(key, tag)
+            if not tag:
+                found = column.is_string & numpy.in1d(column.strings,
+                                                      value.split(','))
+            elif column.opaque:
+                return None
+            elif ',' in value:
+                found = numpy.zeros(len(self.records), dtype=bool)
+            else:
+                found = column.contains_item(value)
+            if filter_name == 'not-in-list':
+                found = ~found
+            return column.truthy & found
+
+        if filter_name in STRING_FILTERS:
+            column = self.column(key, tag)
+            if filter_name == 'not-substring':
+                if column.mixed:
+                    return None
+                return column.present & ~column.is_none & ~column.contains(value)
+
+            if column.opaque:
+                return None
+            if filter_name.endswith('substring'):
+                found = column.contains(value)
+            elif filter_name.endswith('starts-with'):
+                found = numpy.char.startswith(column.strings, value)
+            else:
+                found = numpy.char.endswith(column.strings, value)
+            if filter_name.startswith('not-'):
+                found = ~found
+            return column.truthy & found
+
+        return None
+
+    def select(self, masks, positions=None):
+        """Returns the sorted positions at which every mask is true, among
+        ``positions`` when given
+        """
+        mask = numpy.logical_and.reduce(masks)
+        if positions is None:
+            return numpy.flatnonzero(mask).tolist()
+        positions = numpy.array(positions, dtype=numpy.intp)
+        return positions[mask[positions]].tolist()
@@ -0,0 +1,205 @@
+import struct
+import zlib
+
+import lru
+
+from app.config import Config
+from app.utils import EncodedFragment
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+GZIP_HEADER = '\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff'
+
+
+def available_encodings(encodings=None):
+    if encodings is None:
+        encodings = Config.COMPRESSION_ENCODINGS
+    return [encoding for encoding in encodings
+            if encoding == 'gzip' or (encoding == 'br' and brotli is not None)]
+
+
+def negotiate(accept_encodings, encodings=None):
+    """Returns the content coding to compress a response with, or ``None``
+
+    ``accept_encodings`` is the request's parsed ``Accept-Encoding`` header.
+    Among the codings the client accepts with the highest quality, the one
+    listed first in ``encodings`` wins.
+    """
+    best, best_quality = None, 0
+    for encoding in available_encodings(encodings):
+        quality = accept_encodings[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(chunks, encoding, level=None):
+    if encoding == 'gzip':
+        return iter_gzip(chunks, level=level)
+    if encoding == 'br':
+        return iter_brotli(chunks, level=level)
+    raise LookupError('Unsupported content coding {0}'.format(encoding))
+
+
+class DeflatedFragment(EncodedFragment):
+    """A piece of a document compressed ahead of time as raw deflate blocks
+
+    The blocks end on a byte boundary and are not final, so ``iter_gzip``
+    can splice them between blocks it compresses itself. The checksum and
+    length of the uncompressed text are kept for the gzip trailer.
+    """
+
+    __slots__ = ('deflated', 'crc', 'size')
+
+    def __init__(self, chunks, level=None):
+        if level is None:
+            level = Config.COMPRESSION_LEVEL
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        deflated = []
+        crc = 0
+        size = 0
+        for chunk in chunks:
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            deflated.append(compressor.compress(chunk))
+        deflated.append(compressor.flush(zlib.Z_SYNC_FLUSH))
+        self.deflated = ''.join(deflated)
+        self.crc = crc & 0xffffffff
+        self.size = size
+
+
+def iter_gzip(chunks, level=None):
+    """Yields ``chunks`` compressed as a single gzip member
+
+    ``DeflatedFragment`` chunks are copied into the output as-is rather than
+    compressed again.
+    """
+    if level is None:
+        level = Config.COMPRESSION_LEVEL
+    yield GZIP_HEADER
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    crc = 0
+    size = 0
+    for chunk in chunks:
+        if isinstance(chunk, DeflatedFragment):
+            yield compressor.flush(zlib.Z_SYNC_FLUSH)
+            yield chunk.deflated
+            crc = crc32_combine(crc, chunk.crc, chunk.size)
+            size += chunk.size
+            compressor = zlib.compressobj(level,
+                                          zlib.DEFLATED,
+                                          -zlib.MAX_WBITS)
+            continue
+
+        crc = zlib.crc32(chunk, crc)
+        size += len(chunk)
+        deflated = compressor.compress(chunk)
+        if deflated:
+            yield deflated
+
+    yield compressor.flush(zlib.Z_FINISH)
+    yield struct.pack('<II', crc & 0xffffffff, size & 0xffffffff)
+
+
+def iter_brotli(chunks, level=None):
+    if level is None:
+        level = Config.COMPRESSION_LEVEL
+    compressor = brotli.Compressor(quality=level)
+    for chunk in chunks:
+        compressed = compressor.process(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.finish()
+
+
+def crc32_combine(crc1, crc2, length2):
+    """Returns the crc32 of two strings joined, given the crc32 of each and
+    the length of the second - a port of zlib's ``crc32_combine``
+    """
+    crc1 &= 0xffffffff
+    crc2 &= 0xffffffff
+    if length2 <= 0:
+        return crc1
+
+    odd = [0xedb88320] + [1 << n for n in range(31)]
+    even = _gf2_matrix_square(odd)
+    odd = _gf2_matrix_square(even)
+
+    while True:
+        even = _gf2_matrix_square(odd)
+        if length2 & 1:
+            crc1 = _gf2_matrix_times(even, crc1)
+        length2 >>= 1
+        if not length2:
+            break
+
+        odd = _gf2_matrix_square(even)
+        if length2 & 1:
+            crc1 = _gf2_matrix_times(odd, crc1)
+        length2 >>= 1
+        if not length2:
+            break
+
+    return crc1 ^ crc2
+
+
+def _gf2_matrix_times(matrix, vector):
+    total = 0
+    for row in matrix:
+        if not vector:
+            break
+        if vector & 1:
+            total ^= row
+        vector >>= 1
+    return total
+
+
+def _gf2_matrix_square(matrix):
+    return [_gf2_matrix_times(matrix, row) for row in matrix]
+
+
+class PrecompressedBodies(object):
+    """Keeps the gzipped body of unfiltered listings between requests
+
+    Entries are keyed by the versions of the snapshots a body was built
+    from, so a refreshed snapshot is never served from a stale entry, and
+    old entries simply age out of the cache.
+    """
+
+    def __init__(self, max_size=None, expiration=None):
+        if max_size is None:
+            max_size = Config.PRECOMPRESSED_BODIES
+        if expiration is None:
+            expiration = Config.SNAPSHOT_MAX_STALENESS
+        self.cache = lru.LRUCacheDict(max(max_size, 1), expiration)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, build):
+        """Returns the ``DeflatedFragment`` for ``key``, compressing the
+        chunks returned by ``build()`` when it is not cached
+        """
+        try:
+            fragment = self.cache[key]
+        except KeyError:
+            self.misses += 1
+            fragment = DeflatedFragment(build())
+            if self.max_size:
+                self.cache[key] = fragment
+            return fragment
+
+        self.hits += 1
+        return fragment
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': self.cache.size(),
+        }
@@ -1,8 +1,10 @@
 import os
+import tempfile
 from app.utils import to_bool
 
 
 class Config(object):
+    ADMIN_AUTH = os.getenv('ADMIN_AUTH')
     ALLOWED_IPS = filter(None, os.getenv('ALLOWED_IPS', '').split(','))
     ALTERNATIVE_AUTOSCALE_TAG_NAME = os.getenv('ALTERNATIVE_AUTOSCALE_TAG_NAME', None)
     AWS_ACCESS_KEY_ID = os.getenv('AWS_ACCESS_KEY_ID')
@@ -14,8 +16,40 @@ class Config(object):
     BUGSNAG_API_KEY = os.getenv('BUGSNAG_API_KEY')
     CACHE_EXPIRATION = int(os.getenv('CACHE_EXPIRATION', 180))
     CACHE_SIZE = int(os.getenv('CACHE_SIZE', 1024))
+    COLUMNAR_FILTERS = to_bool(os.getenv('COLUMNAR_FILTERS', 1))
+    COMPRESSION_ENCODINGS = filter(None, os.getenv('COMPRESSION_ENCODINGS', 'gzip,br').split(','))
+    COMPRESSION_LEVEL = int(os.getenv('COMPRESSION_LEVEL', 6))
     DEBUG = to_bool(os.getenv('DEBUG', 0))
+    INDEXED_ATTRIBUTES = filter(None, os.getenv('INDEXED_ATTRIBUTES', ','.join([
+        'availability_zone',
+        'group',
+        'id',
+        'instance_class',
+        'instance_type',
+        'name',
+        'private_ip_address',
+        'status',
+        'vpc_id',
+    ])).split(','))
+    INDEXED_TAGS = filter(None, os.getenv('INDEXED_TAGS', '').split(','))
+    JSON_ENCODER = os.getenv('JSON_ENCODER', 'auto')
     LISTEN_INTERFACE = os.getenv('LISTEN_INTERFACE', '0.0.0.0')
     PORT = int(os.getenv('PORT', 5000))
+    PRECOMPRESSED_BODIES = int(os.getenv('PRECOMPRESSED_BODIES', 16))
+    RDS_TAG_BACKOFF = float(os.getenv('RDS_TAG_BACKOFF', 0.5))
+    RDS_TAG_CONCURRENCY = int(os.getenv('RDS_TAG_CONCURRENCY', 10))
+    RDS_TAG_RETRIES = int(os.getenv('RDS_TAG_RETRIES', 5))
+    RDS_TAG_STRATEGY = os.getenv('RDS_TAG_STRATEGY', 'tagging-api')
+    REGION_CONCURRENCY = int(os.getenv('REGION_CONCURRENCY', 10))
+    REGION_TIMEOUT = int(os.getenv('REGION_TIMEOUT', 30))
+    RESOURCE_POOL_SIZE = int(os.getenv('RESOURCE_POOL_SIZE', 4))
+    RESULT_CACHE_MAX_ELEMENTS = int(os.getenv('RESULT_CACHE_MAX_ELEMENTS', 200000))
+    RESULT_CACHE_SIZE = int(os.getenv('RESULT_CACHE_SIZE', 256))
+    SEARCH_INDEXED_ATTRIBUTES = filter(None, os.getenv('SEARCH_INDEXED_ATTRIBUTES', 'group,image_name,name').split(','))
+    SEARCH_INDEXED_TAGS = filter(None, os.getenv('SEARCH_INDEXED_TAGS', '').split(','))
     SENTRY_DSN = os.getenv('SENTRY_DSN')
+    SNAPSHOT_BACKGROUND_REFRESH = to_bool(os.getenv('SNAPSHOT_BACKGROUND_REFRESH', 1))
+    SNAPSHOT_DIR = os.getenv('SNAPSHOT_DIR', os.path.join(tempfile.gettempdir(), 'haldane'))
+    SNAPSHOT_MAX_STALENESS = int(os.getenv('SNAPSHOT_MAX_STALENESS', 900))
+    SNAPSHOT_REFRESH_INTERVAL = int(os.getenv('SNAPSHOT_REFRESH_INTERVAL', 150))
     TOP_LEVEL_AWS_TAG_ATTRIBUTES = filter(None, os.getenv('TOP_LEVEL_AWS_TAG_ATTRIBUTES', '').split(','))
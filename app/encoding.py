@@ -0,0 +1,67 @@
+import json
+
+try:
+    import simplejson
+except ImportError:
+    simplejson = None
+
+
+INDENT = 2
+PRETTY_SEPARATORS = (',', ': ')
+COMPACT_SEPARATORS = (',', ':')
+
+ENCODERS = {
+    'json': json,
+    'simplejson': simplejson,
+}
+
+encoder = simplejson or json
+
+
+def use_encoder(name):
+    """Selects the module used to encode JSON responses
+
+    ``auto`` picks ``simplejson`` when it is installed, as its C speedups
+    also cover sorted keys, and the stdlib ``json`` module otherwise. Both
+    produce byte-identical output.
+    """
+    global encoder
+    if name == 'auto':
+        encoder = simplejson or json
+    elif ENCODERS.get(name) is not None:
+        encoder = ENCODERS[name]
+    else:
+        raise LookupError('JSON encoder {0} is not available'.format(name))
+    return encoder
+
+
+def dumps(value, pretty=True):
+    """Encodes ``value`` with sorted keys, either indented or compact"""
+    if pretty:
+        return encoder.dumps(value,
+                             sort_keys=True,
+                             indent=INDENT,
+                             separators=PRETTY_SEPARATORS,
+                             default=to_dict)
+    return encoder.dumps(value,
+                         sort_keys=True,
+                         separators=COMPACT_SEPARATORS,
+                         default=to_dict)
+
+
+def to_dict(value):
+    """Encodes objects that know their own dict shape, such as records"""
+    if not hasattr(value, 'to_dict'):
+        raise TypeError('{0!r} is not JSON serializable'.format(value))
+    return value.to_dict()
+
+
+def indent_json(encoded, level):
+    """Shifts pretty-printed JSON right by ``level`` indentation steps
+
+    Encoded strings never contain a literal newline, so every newline in
+    ``encoded`` starts a new line of structure.
+    """
+    if not level:
+        return encoded
+    return encoded.replace('\n', '\n' + ' ' * (INDENT * level))
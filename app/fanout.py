@@ -0,0 +1,69 @@
+import gevent.monkey
+gevent.monkey.patch_all()  # noqa
+
+import time
+
+import gevent
+import gevent.pool
+
+from app.config import Config
+
+
+class RegionTimeout(Exception):
+    def __init__(self, region, timeout):
+        super(RegionTimeout, self).__init__(
+            'Timed out after {0}s retrieving region {1}'.format(timeout, region))
+        self.region = region
+        self.timeout = timeout
+
+
+def fan_out(func, regions, concurrency=None, timeout=None,
+            return_exceptions=False):
+    """Calls ``func(region)`` for every region on a bounded greenlet pool
+
+    Results are returned in the same order as ``regions``, regardless of the
+    order in which each region finished, alongside a dict of the number of
+    seconds each region took. The first region to fail - in region order -
+    has its exception re-raised once every region has completed, unless
+    ``return_exceptions`` is set, in which case each failed region's
+    exception is returned in place of its result.
+    """
+    if concurrency is None:
+        concurrency = Config.REGION_CONCURRENCY
+    if timeout is None:
+        timeout = Config.REGION_TIMEOUT
+
+    timings = {}
+
+    def timed(region):
+        time_start = time.time()
+        try:
+            with gevent.Timeout(timeout or None, RegionTimeout(region, timeout)):
+                return func(region)
+        except Exception as e:
+            # returned rather than raised, so that the greenlet does not die
+            # with it and have the hub print its traceback
+            return Failure(e)
+        finally:
+            timings[region] = time.time() - time_start
+
+    pool = gevent.pool.Pool(max(concurrency, 1))
+    greenlets = [pool.spawn(timed, region) for region in regions]
+    gevent.joinall(greenlets)
+
+    results = []
+    for greenlet in greenlets:
+        result = greenlet.value
+        if isinstance(result, Failure):
+            if not return_exceptions:
+                raise result.exception
+            result = result.exception
+        results.append(result)
+    return results, timings
+
+
+class Failure(object):
+    __slots__ = ('exception',)
+
+    def __init__(self, exception):
+        self.exception = exception
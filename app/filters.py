@@ -1,333 +1,516 @@
+import bisect
+import itertools
+
 from app.config import Config
 from app.utils import to_bool
 
 
-def filter_elements(elements, request_args, query=None, status=None):
-    request_args = request_args.to_dict()
-    if query:
-        request_args['substring.name'] = query
-    elements = filter_by_args(elements, request_args)
-    elements = filter_by_tags(elements, request_args)
-
-    return elements
-
+FILTER_NAMES = [
+    'not-starts-with',
+    'not-ends-with',
+    'not-substring',
+    'not-in-list',
+    'starts-with',
+    'ends-with',
+    'substring',
+    'is-false',
+    'is-true',
+    'is-null',
+    'in-list',
+]
+
+# predicates are evaluated cheapest and most selective first
+FILTER_RANKS = {
+    'exact': 0,
+    'is-null': 1,
+    'in-list': 2,
+    'is-true': 3,
+    'is-false': 3,
+    'starts-with': 4,
+    'ends-with': 4,
+    'substring': 5,
+    'not-in-list': 6,
+    'not-starts-with': 7,
+    'not-ends-with': 7,
+    'not-substring': 8,
+}
+
+EMPTY_BUCKET = frozenset()
+
+SEARCH_FILTER_NAMES = frozenset(['starts-with', 'ends-with', 'substring'])
+
+VALID_SEARCH_KEYS = [
+    # common
+    'availability_zone',
+    'id',
+    'name',
+    'region',
+    'status',
+
+    #  ec2
+    'elastic_ip',
+    'group',
+    'image_id',
+    'image_name',
+    'instance_type',
+    'instance_class',
+    'instance_profile_id',
+    'instance_profile_name',
+    'ip_address',
+    'private_ip_address',
+    'vpc_id',
+
+    # rds
+    'allocated_storage',
+    'auto_minor_version_upgrade',
+    'backup_retention_period',
+    'ca_certificate_identifier',
+    'copy_tags_to_snapshot',
+    'db_instance_arn',
+    'db_instance_class',
+    'db_instance_port',
+    'db_instance_status',
+    'db_name',
+    'dbi_resource_id',
+    'engine',
+    'engine_version',
+    'enhanced_monitoring_resource_arn',
+    'license_model',
+    'master_username',
+    'monitoring_interval',
+    'monitoring_role_arn',
+    'multi_az',
+    'preferred_backup_window',
+    'preferred_maintenance_window',
+    'publicly_accessible',
+    'secondary_availability_zone',
+    'storage_encrypted',
+    'storage_type',
+]
 
-def filter_by_args(elements, args):
-    valid_search_keys = [
-        # common
-        'availability_zone',
-        'id',
-        'name',
-        'region',
-        'status',
-
-        #  ec2
-        'elastic_ip',
-        'group',
-        'image_id',
-        'image_name',
-        'instance_type',
-        'instance_class',
-        'instance_profile_id',
-        'instance_profile_name',
-        'ip_address',
-        'private_ip_address',
-        'vpc_id',
-
-        # rds
-        'allocated_storage',
-        'auto_minor_version_upgrade',
-        'backup_retention_period',
-        'ca_certificate_identifier',
-        'copy_tags_to_snapshot',
-        'db_instance_arn',
-        'db_instance_class',
-        'db_instance_port',
-        'db_instance_status',
-        'db_name',
-        'dbi_resource_id',
-        'engine',
-        'engine_version',
-        'enhanced_monitoring_resource_arn',
-        'license_model',
-        'master_username',
-        'monitoring_interval',
-        'monitoring_role_arn',
-        'multi_az',
-        'preferred_backup_window',
-        'preferred_maintenance_window',
-        'publicly_accessible',
-        'secondary_availability_zone',
-        'storage_encrypted',
-        'storage_type',
-    ] + Config.BOOLEAN_AWS_TAG_ATTRIBUTES
-    bool_search_keys = [
-        'elastic_ip',
-    ] + Config.BOOLEAN_AWS_TAG_ATTRIBUTES
-    not_starts_with_filters, args = get_filter(args, 'not-starts-with', valid_search_keys=valid_search_keys, bool_search_keys=bool_search_keys)
-    not_ends_with_filters, args = get_filter(args, 'not-ends-with', valid_search_keys=valid_search_keys, bool_search_keys=bool_search_keys)
-    not_substring_filters, args = get_filter(args, 'not-substring', valid_search_keys=valid_search_keys, bool_search_keys=bool_search_keys)
-    not_in_list_filters, args = get_filter(args, 'not-in-list', valid_search_keys=valid_search_keys, bool_search_keys=bool_search_keys)
-    starts_with_filters, args = get_filter(args, 'starts-with', valid_search_keys=valid_search_keys, bool_search_keys=bool_search_keys)
-    ends_with_filters, args = get_filter(args, 'ends-with', valid_search_keys=valid_search_keys, bool_search_keys=bool_search_keys)
-    substring_filters, args = get_filter(args, 'substring', valid_search_keys=valid_search_keys, bool_search_keys=bool_search_keys)
-    is_false_filters, args = get_filter(args, 'is-false', valid_search_keys=valid_search_keys, bool_search_keys=bool_search_keys)
-    is_true_filters, args = get_filter(args, 'is-true', valid_search_keys=valid_search_keys, bool_search_keys=bool_search_keys)
-    is_null_filters, args = get_filter(args, 'is-null', valid_search_keys=valid_search_keys, bool_search_keys=bool_search_keys)
-    in_list_filters, args = get_filter(args, 'in-list', valid_search_keys=valid_search_keys, bool_search_keys=bool_search_keys)
-    exact_filters, args = get_filter(args, 'exact', valid_search_keys=valid_search_keys, bool_search_keys=bool_search_keys)
-
-    bool_search_keys = [
-        'elastic_ip',
-    ]
-
-    for key, value in exact_filters.items():
-        _elements = []
-        for element in elements:
-            attribute = element.get(key, '')
-            if not attribute and value:
-                continue
-
-            if key in bool_search_keys:
-                attribute = to_bool(attribute)
-
-            if value == attribute:
-                _elements.append(element)
-        elements = _elements
-    for key, value in is_null_filters.items():
-        _elements = []
-        for element in elements:
-            attribute = element.get(key, '')
-            if attribute is None:
-                _elements.append(element)
-        elements = _elements
-    for key, value in is_true_filters.items():
-        _elements = []
-        for element in elements:
-            attribute = element.get(key, None)
-            if attribute is True:
-                _elements.append(element)
-        elements = _elements
-    for key, value in is_false_filters.items():
-        _elements = []
-        for element in elements:
-            attribute = element.get(key, None)
-            if attribute is False:
-                _elements.append(element)
-        elements = _elements
-    for key, value in in_list_filters.items():
-        _elements = []
-        for element in elements:
-            attribute = element.get(key)
-            if not attribute:
-                continue
 
-            if attribute in value.split(','):
-                _elements.append(element)
-        elements = _elements
-    for key, value in substring_filters.items():
-        _elements = []
-        for element in elements:
-            attribute = element.get(key)
-            if not attribute:
-                continue
+def filter_elements(elements, request_args, query=None, status=None):
+    return compile_filters(request_args, query=query).filter(elements)
 
-            if value in attribute:
-                _elements.append(element)
-        elements = _elements
-    for key, value in starts_with_filters.items():
-        _elements = []
-        for element in elements:
-            attribute = element.get(key)
-            if not attribute:
-                continue
 
-            if attribute.startswith(value):
-                _elements.append(element)
-        elements = _elements
-    for key, value in ends_with_filters.items():
-        _elements = []
-        for element in elements:
-            attribute = element.get(key)
-            if not attribute:
-                continue
+def filter_by_args(elements, args):
+    return FilterPlan(parse_attribute_filters(args)).filter(elements)
 
-            if attribute.endswith(value):
-                _elements.append(element)
-        elements = _elements
 
-    for key, value in not_in_list_filters.items():
-        _elements = []
-        for element in elements:
-            attribute = element.get(key)
-            if not attribute:
-                continue
+def filter_by_tags(elements, args):
+    return FilterPlan(parse_tag_filters(args)).filter(elements)
 
-            if attribute not in value.split(','):
-                _elements.append(element)
-        elements = _elements
-    for key, value in not_substring_filters.items():
-        _elements = []
-        for element in elements:
-            attribute = element.get(key, None)
-            if attribute is None:
-                continue
 
-            if value not in attribute:
-                _elements.append(element)
-        elements = _elements
-    for key, value in not_starts_with_filters.items():
-        _elements = []
-        for element in elements:
-            attribute = element.get(key)
-            if not attribute:
+def compile_filters(request_args, query=None):
+    """Parses request arguments into a ``FilterPlan`` for attributes and tags"""
+    args = request_args.to_dict()
+    if query:
+        args['substring.name'] = query
+    return FilterPlan(parse_attribute_filters(args) + parse_tag_filters(args))
+
+
+class FilterPlan(object):
+    """A conjunction of predicates, evaluated in a single pass per element
+
+    When given the ``indexes`` of the elements (see ``build_index``), exact
+    and in-list predicates on indexed keys are answered by intersecting
+    index lookups, and only the elements in that intersection are checked
+    against the remaining predicates.
+    """
+
+    def __init__(self, predicates):
+        self.predicates = sorted(predicates, key=lambda p: (p.rank, p.tag))
+        self.tests = [predicate.test for predicate in self.predicates]
+
+    def matches(self, element, tests=None):
+        if tests is None:
+            tests = self.tests
+        for test in tests:
+            if not test(element):
+                return False
+        return True
+
+    def filter(self, elements, indexes=None):
+        return list(self.iter_filter(elements, indexes))
+
+    def iter_filter(self, elements, indexes=None, plan=None):
+        if plan is None:
+            plan = self.plan(indexes)
+        positions, tests = plan
+        candidates = elements
+        if positions is not None:
+            candidates = (elements[position] for position in positions)
+        if not tests:
+            return iter(candidates)
+        return (element for element in candidates
+                if self.matches(element, tests))
+
+    def plan(self, indexes=None, columns=None, search_indexes=None):
+        """Returns the sorted positions of candidate elements - or ``None``
+        if every element is a candidate - and the tests left to run on them
+
+        Given the ``search_indexes`` of the elements (see
+        ``build_search_index``), prefix, suffix and substring predicates on
+        indexed keys are answered like exact ones. Given their
+        ``SnapshotColumns``, predicates that no index answers are evaluated
+        over whole columns at once rather than tested element by element.
+        """
+        if not indexes and not search_indexes and columns is None:
+            return None, self.tests
+
+        buckets = []
+        masks = []
+        tests = []
+        for predicate in self.predicates:
+            bucket = predicate.lookup(indexes or {}, search_indexes)
+            if bucket is not None:
+                buckets.append(bucket)
                 continue
-
-            if not attribute.startswith(value):
-                _elements.append(element)
-        elements = _elements
-    for key, value in not_ends_with_filters.items():
-        _elements = []
-        for element in elements:
-            attribute = element.get(key)
-            if not attribute:
+            mask = None if columns is None else columns.mask(predicate)
+            if mask is None:
+                tests.append(predicate.test)
+            else:
+                masks.append(mask)
+
+        positions = None
+        if buckets:
+            buckets.sort(key=len)
+            positions = sorted(buckets[0].intersection(*buckets[1:]))
+        if masks:
+            positions = columns.select(masks, positions)
+        return positions, tests
+
+
+class FilteredElements(object):
+    """Lazily filters the records of several snapshots with a ``FilterPlan``
+
+    Candidates are planned from each snapshot's indexes on first use, which
+    gives ``estimate``, an upper bound on the number of matching records.
+    Records are only tested as they are iterated over, so consumers that
+    stop early never pay for the rest, and consumers that never look at the
+    records - such as a conditional request that turns out not modified -
+    pay for nothing.
+    """
+
+    def __init__(self, plan, snapshots):
+        self.filter_plan = plan
+        self.snapshots = snapshots
+        self._plans = None
+
+    @property
+    def plans(self):
+        if self._plans is None:
+            self._plans = [(snapshot, self.filter_plan.plan(
+                snapshot.indexes, snapshot.columns, snapshot.search_indexes))
+                for snapshot in self.snapshots]
+        return self._plans
+
+    @property
+    def estimate(self):
+        estimate = 0
+        for snapshot, (positions, tests) in self.plans:
+            if positions is None:
+                estimate += len(snapshot.records)
+            else:
+                estimate += len(positions)
+        return estimate
+
+    @property
+    def unfiltered(self):
+        return not self.filter_plan.predicates
+
+    def __iter__(self):
+        for snapshot, plan in self.plans:
+            for element in self.filter_plan.iter_filter(snapshot.records,
+                                                        plan=plan):
+                yield element
+
+    def partition(self, key, values=None):
+        """Returns a dict of the matching records sharing each value of their
+        ``key`` attribute, each in the same order as iterating would yield
+
+        Only the records of the given ``values`` are tested, when given, by
+        way of each snapshot's ``partition_by``.
+        """
+        partitions = {}
+        for snapshot, members in self._partition_members(key, values):
+            records = snapshot.records
+            for value, positions in members:
+                matching = [records[position] for position in positions]
+                if matching:
+                    partitions.setdefault(value, []).extend(matching)
+        return partitions
+
+    def partition_counts(self, key, values=None):
+        """Returns the number of matching records for each value of their
+        ``key`` attribute, without gathering the records themselves
+        """
+        counts = {}
+        for snapshot, members in self._partition_members(key, values):
+            for value, positions in members:
+                if isinstance(positions, list):
+                    count = len(positions)
+                else:
+                    count = sum(1 for _ in positions)
+                if count:
+                    counts[value] = counts.get(value, 0) + count
+        return counts
+
+    def _partition_members(self, key, values=None):
+        """Yields each snapshot along with ``(value, positions)`` pairs of the
+        positions of its matching records for each value of ``key``
+        """
+        for snapshot, (positions, tests) in self.plans:
+            partition = snapshot.partition_by(key)
+            if values is None:
+                items = partition.items()
+            else:
+                items = [(value, partition[value])
+                         for value in values if value in partition]
+
+            if positions is None and not tests:
+                yield snapshot, items
                 continue
 
-            if not attribute.endswith(value):
-                _elements.append(element)
-        elements = _elements
-
-    return elements
-
+            candidates = None if positions is None else set(positions)
+            yield snapshot, [
+                (value, self._matching(snapshot.records, members, candidates, tests))
+                for value, members in items]
 
-def filter_by_tags(elements, args):
-    not_starts_with_filters, args = get_filter(args, 'tags.not-starts-with')
-    not_ends_with_filters, args = get_filter(args, 'tags.not-ends-with')
-    not_substring_filters, args = get_filter(args, 'tags.not-substring')
-    not_in_list_filters, args = get_filter(args, 'tags.not-in-list')
-    starts_with_filters, args = get_filter(args, 'tags.starts-with')
-    ends_with_filters, args = get_filter(args, 'tags.ends-with')
-    substring_filters, args = get_filter(args, 'tags.substring')
-    is_false_filters, args = get_filter(args, 'tags.is-false')
-    is_true_filters, args = get_filter(args, 'tags.is-true')
-    is_null_filters, args = get_filter(args, 'tags.is-null')
-    in_list_filters, args = get_filter(args, 'tags.in-list')
-    exact_filters, args = get_filter(args, 'tags.exact')
-
-    for key, value in exact_filters.items():
-        _elements = []
-        for element in elements:
-            attribute = element.get('tags', {}).get(key)
-            if not attribute and value:
+    def _matching(self, records, positions, candidates, tests):
+        for position in positions:
+            if candidates is not None and position not in candidates:
                 continue
-
-            if value == attribute:
-                _elements.append(element)
-        elements = _elements
-    for key, value in is_null_filters.items():
-        _elements = []
-        for element in elements:
-            attribute = element.get('tags', {}).get(key, '')
-            if attribute is None:
-                _elements.append(element)
-        elements = _elements
-    for key, value in is_true_filters.items():
-        _elements = []
-        for element in elements:
-            attribute = element.get('tags', {}).get(key, None)
-            if attribute is True:
-                _elements.append(element)
-        elements = _elements
-    for key, value in is_false_filters.items():
-        _elements = []
-        for element in elements:
-            attribute = element.get('tags', {}).get(key, None)
-            if attribute is False:
-                _elements.append(element)
-        elements = _elements
-    for key, value in in_list_filters.items():
-        _elements = []
-        for element in elements:
-            attribute = element.get('tags', {}).get(key)
-            if not attribute:
+            if self.filter_plan.matches(records[position], tests):
+                yield position
+
+    def iter_ordered(self, key='id', after=None):
+        """Yields the matching records ordered by region, then by ``key``
+
+        When given a ``(region, value)`` pair as ``after``, only the records
+        that sort after it are yielded. The order only depends on the
+        records themselves, so a walk resumed after a snapshot refresh
+        neither repeats nor skips the records both snapshots hold.
+        """
+        plans = sorted(self.plans, key=lambda plan: plan[0].region)
+        for snapshot, (positions, tests) in plans:
+            if after is not None and snapshot.region < after[0]:
                 continue
 
-            if value in attribute.split(','):
-                _elements.append(element)
-        elements = _elements
-    for key, value in substring_filters.items():
-        _elements = []
-        for element in elements:
-            attribute = element.get('tags', {}).get(key)
-            if not attribute:
-                continue
+            order, values = snapshot.order_by(key)
+            start = 0
+            if after is not None and snapshot.region == after[0]:
+                start = bisect.bisect_right(values, after[1])
+
+            candidates = None if positions is None else set(positions)
+            records = snapshot.records
+            for position in itertools.islice(order, start, None):
+                if candidates is not None and position not in candidates:
+                    continue
+                element = records[position]
+                if self.filter_plan.matches(element, tests):
+                    yield element
+
+
+class Predicate(object):
+    def __init__(self, filter_name, key, value, tag=False):
+        self.filter_name = filter_name
+        self.key = key
+        self.value = value
+        self.tag = tag
+        self.rank = FILTER_RANKS[filter_name]
+        self.test = build_test(filter_name, key, value, tag)
+
+    def lookup(self, indexes, search_indexes=None):
+        """Returns the positions matching this predicate from ``indexes`` or
+        ``search_indexes``, or ``None`` if it cannot be answered by an index
+        """
+        if self.filter_name in SEARCH_FILTER_NAMES:
+            search_index = (search_indexes or {}).get((self.tag, self.key))
+            if search_index is None:
+                return None
+            return search_index.lookup(self.filter_name, self.value)
+
+        index = indexes.get((self.tag, self.key))
+        if index is None:
+            return None
+
+        if self.filter_name == 'exact':
+            if self.key == 'elastic_ip' and not self.tag:
+                return None
+            try:
+                return index.get(self.value, EMPTY_BUCKET)
+            except TypeError:
+                return None
+
+        if self.filter_name == 'in-list' and not self.tag:
+            buckets = [index.get(value, EMPTY_BUCKET)
+                       for value in set(self.value.split(',')) if value]
+            return EMPTY_BUCKET.union(*buckets)
+
+        return None
+
+    def __repr__(self):
+        return 'Predicate({0!r}, {1!r}, {2!r}, tag={3!r})'.format(
+            self.filter_name, self.key, self.value, self.tag)
+
+
+def parse_attribute_filters(args):
+    """Parses attribute filters from request arguments in a single pass
+
+    Mirrors successive calls to ``get_filter`` for every filter name: bare
+    arguments such as ``group=www`` are exact filters, and filters on keys
+    that are not valid search keys are ignored.
+    """
+    valid_search_keys = VALID_SEARCH_KEYS + Config.BOOLEAN_AWS_TAG_ATTRIBUTES
+    bool_search_keys = ['elastic_ip'] + Config.BOOLEAN_AWS_TAG_ATTRIBUTES
 
-            if value in attribute:
-                _elements.append(element)
-        elements = _elements
-    for key, value in starts_with_filters.items():
-        _elements = []
-        for element in elements:
-            attribute = element.get('tags', {}).get(key)
-            if not attribute:
-                continue
+    filters = {}
+    for key, value in args.items():
+        if key in bool_search_keys:
+            value = to_bool(value)
 
-            if attribute.startswith(value):
-                _elements.append(element)
-        elements = _elements
-    for key, value in ends_with_filters.items():
-        _elements = []
-        for element in elements:
-            attribute = element.get('tags', {}).get(key)
-            if not attribute:
+        filter_name, attribute = _split_filter(key)
+        if filter_name is None:
+            if key.startswith('exact.'):
+                attribute = key[len('exact.'):]
+            elif '.' not in key:
+                attribute = key
+            else:
                 continue
+            filter_name = 'exact'
 
-            if attribute.endswith(value):
-                _elements.append(element)
-        elements = _elements
+        if attribute in valid_search_keys:
+            filters[(filter_name, attribute)] = value
 
-    for key, value in not_in_list_filters.items():
-        _elements = []
-        for element in elements:
-            attribute = element.get('tags', {}).get(key)
-            if not attribute:
-                continue
+    predicates = []
+    for (filter_name, attribute), value in filters.items():
+        predicates.append(Predicate(filter_name, attribute, value))
+    return predicates
 
-            if value not in attribute.split(','):
-                _elements.append(element)
-        elements = _elements
-    for key, value in not_substring_filters.items():
-        _elements = []
-        for element in elements:
-            attribute = element.get('tags', {}).get(key, None)
-            if attribute is None:
-                continue
 
-            if value not in attribute:
-                _elements.append(element)
-        elements = _elements
-    for key, value in not_starts_with_filters.items():
-        _elements = []
-        for element in elements:
-            attribute = element.get('tags', {}).get(key)
-            if not attribute:
-                continue
+def parse_tag_filters(args):
+    """Parses tag filters from request arguments in a single pass
 
-            if not attribute.startswith(value):
-                _elements.append(element)
-        elements = _elements
-    for key, value in not_ends_with_filters.items():
-        _elements = []
-        for element in elements:
-            attribute = element.get('tags', {}).get(key)
-            if not attribute:
-                continue
-
-            if not attribute.endswith(value):
-                _elements.append(element)
-        elements = _elements
+    Mirrors successive calls to ``get_filter`` for every ``tags.`` filter
+    name: ``tags.<key>`` is an exact filter on the ``<key>`` tag.
+    """
+    filters = {}
+    for key, value in args.items():
+        if not key.startswith('tags.'):
+            continue
 
-    return elements
+        filter_name, tag = _split_filter(key[len('tags.'):])
+        if filter_name is None:
+            if key.startswith('tags.exact.'):
+                tag = key[len('tags.exact.'):]
+            else:
+                tag = key.replace('tags.', '')
+            filter_name = 'exact'
+
+        filters[(filter_name, tag)] = value
+
+    predicates = []
+    for (filter_name, tag), value in filters.items():
+        predicates.append(Predicate(filter_name, tag, value, tag=True))
+    return predicates
+
+
+def _split_filter(key):
+    for filter_name in FILTER_NAMES:
+        if key.startswith(filter_name + '.'):
+            return filter_name, key[len(filter_name) + 1:]
+    return None, None
+
+
+def build_index(elements, key, tag=False):
+    """Builds a hash index of element positions by attribute or tag value
+
+    Returns ``None`` when a value cannot be hashed, in which case filters on
+    ``key`` fall back to scanning.
+    """
+    positions = {}
+    try:
+        for position, element in enumerate(elements):
+            if tag:
+                value = element.get('tags', {}).get(key)
+            else:
+                value = element.get(key, '')
+            positions.setdefault(value, []).append(position)
+    except (AttributeError, TypeError):
+        return None
+
+    return dict((value, frozenset(bucket))
+                for value, bucket in positions.items())
+
+
+def build_test(filter_name, key, value, tag=False):
+    if tag:
+        def get(element, default=None):
+            return element.get('tags', {}).get(key, default)
+    else:
+        def get(element, default=None):
+            return element.get(key, default)
+
+    if filter_name == 'exact':
+        if tag:
+            return lambda element: get(element) == value
+        if key == 'elastic_ip':
+            return lambda element: to_bool(get(element, '')) == value
+        return lambda element: get(element, '') == value
+
+    if filter_name == 'is-null':
+        return lambda element: get(element, '') is None
+    if filter_name == 'is-true':
+        return lambda element: get(element) is True
+    if filter_name == 'is-false':
+        return lambda element: get(element) is False
+
+    if filter_name in ['in-list', 'not-in-list']:
+        negate = filter_name == 'not-in-list'
+        if tag:
+            def test(element):
+                attribute = get(element)
+                if not attribute:
+                    return False
+                return (value in attribute.split(',')) is not negate
+        else:
+            values = frozenset(value.split(','))
+
+            def test(element):
+                attribute = get(element)
+                if not attribute:
+                    return False
+                try:
+                    return (attribute in values) is not negate
+                except TypeError:
+                    return negate
+        return test
+
+    if filter_name == 'not-substring':
+        def test(element):
+            attribute = get(element)
+            return attribute is not None and value not in attribute
+        return test
+
+    def truthy(check):
+        def test(element):
+            attribute = get(element)
+            return bool(attribute) and check(attribute)
+        return test
+
+    if filter_name == 'substring':
+        return truthy(lambda attribute: value in attribute)
+    if filter_name == 'starts-with':
+        return truthy(lambda attribute: attribute.startswith(value))
+    if filter_name == 'ends-with':
+        return truthy(lambda attribute: attribute.endswith(value))
+    if filter_name == 'not-starts-with':
+        return truthy(lambda attribute: not attribute.startswith(value))
+    if filter_name == 'not-ends-with':
+        return truthy(lambda attribute: not attribute.endswith(value))
+
+    raise LookupError('Invalid filter {0}'.format(filter_name))
 
 
 def get_filter(args, filter_name, filter_key_prefix=None, valid_search_keys=None, bool_search_keys=None):
@@ -0,0 +1,57 @@
+import boto3
+import collections
+import contextlib
+
+from app.config import Config
+
+
+class ResourcePool(object):
+    """Hands out boto3 resources and clients, reusing them per region
+
+    A boto3 session is not safe to share between concurrently running
+    greenlets, so each pooled object is built from its own session and is
+    checked out exclusively until the ``with`` block exits. At most
+    ``max_size`` idle objects are kept around per service and region.
+    """
+
+    def __init__(self, max_size=None):
+        if max_size is None:
+            max_size = Config.RESOURCE_POOL_SIZE
+        self.max_size = max_size
+        self.created = 0
+        self.reused = 0
+        self._idle = collections.defaultdict(list)
+
+    @contextlib.contextmanager
+    def resource(self, service, region):
+        with self._checkout('resource', service, region) as resource:
+            yield resource
+
+    @contextlib.contextmanager
+    def client(self, service, region):
+        with self._checkout('client', service, region) as client:
+            yield client
+
+    @contextlib.contextmanager
+    def _checkout(self, kind, service, region):
+        key = (kind, service, region)
+        idle = self._idle[key]
+        if idle:
+            self.reused += 1
+            item = idle.pop()
+        else:
+            self.created += 1
+            session = boto3.session.Session()
+            item = getattr(session, kind)(service, region_name=region)
+
+        yield item
+
+        if len(idle) < self.max_size:
+            idle.append(item)
+
+    def stats(self):
+        return {
+            'created': self.created,
+            'reused': self.reused,
+            'idle': sum(len(idle) for idle in self._idle.values()),
+        }
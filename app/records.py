@@ -0,0 +1,243 @@
+import itertools
+
+from app.encoding import dumps
+from app.encoding import indent_json
+
+
+class FrozenRecord(dict):
+    """A dict that refuses to be modified once built
+
+    Snapshot records are shared by every request, so they are frozen to
+    guarantee that formatting a response can never corrupt them. Being a
+    dict subclass, a frozen record serializes like any other dict.
+
+    Since a frozen record can never change, its JSON is encoded once per
+    nesting level - or once, when compact - and kept alongside it; see
+    ``to_json``.
+    """
+
+    __slots__ = ('_json',)
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError('{0} is immutable'.format(type(self).__name__))
+
+    __setitem__ = _immutable
+    __delitem__ = _immutable
+    clear = _immutable
+    pop = _immutable
+    popitem = _immutable
+    setdefault = _immutable
+    update = _immutable
+
+    def __reduce__(self):
+        return (FrozenRecord, (dict(self),))
+
+    def to_json(self, level=0, pretty=True):
+        """Returns the record as ``sorted_json`` would encode it when nested
+        ``level`` containers deep
+        """
+        return cached_json(self, level, pretty)
+
+
+class Record(object):
+    """A compact, immutable snapshot record
+
+    Records of the same shape share a class, made by ``record_class``, that
+    holds their sorted field names, so that each record only holds a tuple
+    of its values rather than a whole hash table. Records read like a dict;
+    the public dict shape itself is only built by ``to_dict``, when a
+    record is encoded.
+    """
+
+    __slots__ = ('_values', '_json')
+
+    fields = ()
+    positions = {}
+
+    def __init__(self, values):
+        self._values = values
+
+    def __getitem__(self, key):
+        return self._values[self.positions[key]]
+
+    def get(self, key, default=None):
+        position = self.positions.get(key)
+        if position is None:
+            return default
+        return self._values[position]
+
+    def __contains__(self, key):
+        return key in self.positions
+
+    def __iter__(self):
+        return iter(self.fields)
+
+    def __len__(self):
+        return len(self.fields)
+
+    def keys(self):
+        return list(self.fields)
+
+    def values(self):
+        return list(self._values)
+
+    def items(self):
+        return zip(self.fields, self._values)
+
+    def iteritems(self):
+        return itertools.izip(self.fields, self._values)
+
+    def to_dict(self):
+        return dict(itertools.izip(self.fields, self._values))
+
+    def __eq__(self, other):
+        if isinstance(other, Record):
+            return self.fields == other.fields and self._values == other._values
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'Record({0!r})'.format(self.to_dict())
+
+    def __reduce__(self):
+        return (make_record, (self.to_dict(),))
+
+    def to_json(self, level=0, pretty=True):
+        """Returns the record as ``sorted_json`` would encode its dict shape
+        when nested ``level`` containers deep
+        """
+        return cached_json(self, level, pretty)
+
+
+_record_classes = {}
+
+
+def record_class(fields):
+    """Returns the ``Record`` class for records with the given sorted
+    ``fields``, creating it on first use
+    """
+    cls = _record_classes.get(fields)
+    if cls is None:
+        cls = type('Record', (Record,), {
+            '__slots__': (),
+            'fields': fields,
+            'positions': dict((field, i) for i, field in enumerate(fields)),
+        })
+        _record_classes[fields] = cls
+    return cls
+
+
+def make_record(mapping, interner=None):
+    """Returns an immutable ``Record`` holding a deeply frozen copy of the
+    fields of ``mapping``, sharing repeated values through ``interner`` when
+    given
+    """
+    if isinstance(mapping, Record):
+        return mapping
+    fields = tuple(sorted(mapping))
+    return record_class(fields)(tuple(freeze(mapping[field], interner)
+                                      for field in fields))
+
+
+class Interner(object):
+    """Shares equal strings and equal flat dicts - tag sets, mostly -
+    between the records of a snapshot
+
+    Thousands of records repeat the same zones, instance types, vpcs and tag
+    keys and values, each as its own string as fetched. Built through an
+    interner, a snapshot keeps a single copy of each distinct value, so its
+    size grows with the number of distinct values rather than of records.
+    Shared frozen dicts also share their cached JSON.
+    """
+
+    def __init__(self):
+        self.strings = {}
+        self.mappings = {}
+        self.string_count = 0
+        self.mapping_count = 0
+
+    def string(self, value):
+        self.string_count += 1
+        return self.strings.setdefault(value, value)
+
+    def mapping(self, record):
+        """Returns the first frozen dict seen equal to ``record``
+
+        Only dicts of hashable values are shared. Values are compared along
+        with their type, so that ``True`` and ``1`` are never confused.
+        """
+        try:
+            key = frozenset((k, type(v), v) for k, v in record.iteritems())
+        except TypeError:
+            return record
+        self.mapping_count += 1
+        return self.mappings.setdefault(key, record)
+
+    def stats(self):
+        return {
+            'mappings': dedup_stats(self.mapping_count, len(self.mappings)),
+            'strings': dedup_stats(self.string_count, len(self.strings)),
+        }
+
+
+def dedup_stats(total, distinct):
+    return {
+        'distinct': distinct,
+        'ratio': float(total) / distinct if distinct else None,
+        'total': total,
+    }
+
+
+def cached_json(record, level, pretty):
+    """Returns the JSON of an immutable record, encoding it once per nesting
+    level - or once, when compact - and keeping it on the record
+    """
+    try:
+        fragments = record._json
+    except AttributeError:
+        fragments = record._json = {}
+
+    key = level if pretty else None
+    fragment = fragments.get(key)
+    if fragment is None:
+        fragment = dumps(record, pretty=pretty)
+        if pretty:
+            fragment = indent_json(fragment, level)
+        fragments[key] = fragment
+    return fragment
+
+
+def freeze(value, interner=None):
+    """Returns a deeply immutable version of a record or record value,
+    sharing repeated strings and dicts through ``interner`` when given
+    """
+    if isinstance(value, FrozenRecord):
+        return value
+    if isinstance(value, dict):
+        record = FrozenRecord((freeze(k, interner), freeze(v, interner))
+                              for k, v in value.items())
+        if interner is not None:
+            record = interner.mapping(record)
+        return record
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v, interner) for v in value)
+    if interner is not None and isinstance(value, basestring):
+        return interner.string(value)
+    return value
+
+
+def project(record, fields):
+    """Returns a new dict holding only the given ``fields`` of a record
+
+    Values are shared with the record rather than copied.
+    """
+    return dict((field, record[field]) for field in fields if field in record)
@@ -0,0 +1,104 @@
+import array
+import bisect
+
+from app.utils import to_utf8
+
+
+NGRAM_SIZE = 3
+
+# no utf-8 encoded string holds this byte, so it sorts after every string
+# that starts with a given prefix
+PREFIX_END = '\xff'
+
+
+class SearchIndex(object):
+    """Answers prefix, suffix and substring filters on one attribute or tag
+    of a snapshot's records without scanning them
+
+    Values are kept utf-8 encoded, where prefixes, suffixes and substrings
+    are the same as on the decoded strings:
+
+    - ``starts-with`` bisects the values, sorted
+    - ``ends-with`` bisects the values reversed, sorted
+    - ``substring`` takes the records holding the rarest trigram of the
+      searched string, then checks only those
+
+    Only non-empty strings are indexed, as ``build_test`` never matches any
+    other value with these filters.
+    """
+
+    def __init__(self, values):
+        self.strings = values
+        self.prefixes = SortedStrings(values)
+        self.suffixes = SortedStrings([value[::-1] for value in values])
+
+        ngrams = {}
+        for position, value in enumerate(values):
+            for ngram in set(value[i:i + NGRAM_SIZE]
+                             for i in range(len(value) - NGRAM_SIZE + 1)):
+                postings = ngrams.get(ngram)
+                if postings is None:
+                    postings = ngrams[ngram] = array.array('i')
+                postings.append(position)
+        self.ngrams = ngrams
+
+    def lookup(self, filter_name, value):
+        """Returns the positions of the records matching the filter, or
+        ``None`` if it cannot be answered by this index
+        """
+        if not isinstance(value, basestring):
+            return None
+        value = to_utf8(value)
+
+        if filter_name == 'starts-with':
+            return frozenset(self.prefixes.starting_with(value))
+        if filter_name == 'ends-with':
+            return frozenset(self.suffixes.starting_with(value[::-1]))
+        if filter_name == 'substring' and len(value) >= NGRAM_SIZE:
+            postings = min((self.ngrams.get(value[i:i + NGRAM_SIZE], ())
+                            for i in range(len(value) - NGRAM_SIZE + 1)),
+                           key=len)
+            strings = self.strings
+            return frozenset(position for position in postings
+                             if value in strings[position])
+        return None
+
+
+class SortedStrings(object):
+    """The positions of non-empty strings in sorted order, along with the
+    sorted strings for bisecting
+    """
+
+    def __init__(self, strings):
+        self.positions = sorted((position
+                                 for position, string in enumerate(strings)
+                                 if string),
+                                key=strings.__getitem__)
+        self.strings = [strings[position] for position in self.positions]
+
+    def starting_with(self, prefix):
+        """Returns the positions of the strings starting with ``prefix``"""
+        start = bisect.bisect_left(self.strings, prefix)
+        end = bisect.bisect_left(self.strings, prefix + PREFIX_END, start)
+        return self.positions[start:end]
+
+
+def build_search_index(elements, key, tag=False):
+    """Builds a ``SearchIndex`` of the values of an attribute or tag
+
+    Returns ``None`` when a value is truthy but not a string, on which the
+    scan would fail rather than answer, in which case filters on ``key``
+    fall back to scanning.
+    """
+    values = []
+    for element in elements:
+        if tag:
+            value = element.get('tags', {}).get(key)
+        else:
+            value = element.get(key)
+        if not value:
+            value = ''
+        elif not isinstance(value, basestring):
+            return None
+        values.append(to_utf8(value))
+    return SearchIndex(values)
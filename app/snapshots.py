@@ -0,0 +1,607 @@
+import gevent.monkey
+gevent.monkey.patch_all()  # noqa
+
+import contextlib
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import stat
+import tempfile
+import time
+
+import gevent
+
+from app.cache import SingleFlight
+from app.columns import SnapshotColumns
+from app.columns import columnar_filters_available
+from app.config import Config
+from app.encoding import dumps
+from app.encoding import to_dict
+from app.filters import build_index
+from app.log import getLogger
+from app.records import Interner
+from app.records import make_record
+from app.search import build_search_index
+
+
+logger = getLogger('haldane')
+
+
+class Snapshot(object):
+    def __init__(self, resource, region, records, fetched_at=None):
+        if fetched_at is None:
+            fetched_at = time.time()
+        self.resource = resource
+        self.region = region
+        interner = Interner()
+        self.records = [make_record(record, interner) for record in records]
+        self.interned = interner.stats()
+        self.columns = None
+        if columnar_filters_available():
+            self.columns = SnapshotColumns(self.records)
+        self.fetched_at = fetched_at
+        # the modification time of the shared file this snapshot was read
+        # from or written to, if any
+        self.shared_at = None
+        self.version = content_version(self.records)
+        self.indexes = {}
+        self.search_indexes = {}
+        self._unique_indexes = {}
+        self._orders = {}
+        self._partitions = {}
+
+    @property
+    def age(self):
+        return time.time() - self.fetched_at
+
+    def index_by(self, key):
+        """Returns a dict of records keyed by their unique ``key`` attribute
+
+        The index is built on first use and kept for the life of the snapshot.
+        """
+        index = self._unique_indexes.get(key)
+        if index is None:
+            index = dict((record.get(key), record) for record in self.records)
+            self._unique_indexes[key] = index
+        return index
+
+    def order_by(self, key):
+        """Returns the positions of the records sorted by their ``key``
+        attribute, along with the sorted ``key`` values for bisecting
+
+        The order is computed on first use and kept for the life of the
+        snapshot.
+        """
+        order = self._orders.get(key)
+        if order is None:
+            positions = sorted(range(len(self.records)),
+                               key=lambda position: self.records[position].get(key))
+            values = [self.records[position].get(key) for position in positions]
+            order = self._orders[key] = (positions, values)
+        return order
+
+    def partition_by(self, key):
+        """Returns a dict of the positions of the records sharing each value
+        of their ``key`` attribute, in ascending order
+
+        The partition is built on first use and kept for the life of the
+        snapshot.
+        """
+        partition = self._partitions.get(key)
+        if partition is None:
+            partition = {}
+            for position, record in enumerate(self.records):
+                partition.setdefault(record.get(key), []).append(position)
+            self._partitions[key] = partition
+        return partition
+
+    def build_indexes(self, attributes=(), tags=()):
+        """Builds the hash indexes used by ``FilterPlan`` to answer exact and
+        in-list filters on the given attributes and tags without scanning
+        """
+        keys = [(False, key) for key in attributes]
+        keys.extend((True, key) for key in tags)
+        for tag, key in keys:
+            index = build_index(self.records, key, tag=tag)
+            if index is not None:
+                self.indexes[(tag, key)] = index
+
+    def build_search_indexes(self, attributes=(), tags=()):
+        """Builds the search indexes used by ``FilterPlan`` to answer prefix,
+        suffix and substring filters on the given attributes and tags
+        without scanning
+        """
+        keys = [(False, key) for key in attributes]
+        keys.extend((True, key) for key in tags)
+        for tag, key in keys:
+            index = build_search_index(self.records, key, tag=tag)
+            if index is not None:
+                self.search_indexes[(tag, key)] = index
+
+
+def content_version(records):
+    """Returns a hash of the content of ``records``
+
+    Snapshots holding the same records share a version, whenever and by
+    whichever worker they were fetched.
+    """
+    return hashlib.sha1(dumps(records, pretty=False)).hexdigest()
+
+
+def describe_error(exception, failed_at=None):
+    """Returns the error message of a failed refresh along with the time it
+    ``failed_at``
+    """
+    if failed_at is None:
+        failed_at = time.time()
+    return {
+        'error': '{0}'.format(exception) or type(exception).__name__,
+        'failed_at': failed_at,
+    }
+
+
+class SharedSnapshots(object):
+    """Shares snapshots between the worker processes of a host via disk
+
+    Snapshots are written to a temporary file and renamed into place, so
+    readers only ever see a complete snapshot. A lock file per snapshot lets
+    a single worker fetch from AWS while the others wait on the lock and then
+    read the snapshot it wrote.
+
+    The directory is created on first use, and an existing one is only used
+    when it belongs to the current user and is closed to everyone else, so
+    that another user of the host can neither read the inventory nor plant
+    a forged one; see ``usable``.
+    """
+
+    format_version = 1
+
+    def __init__(self, directory, lock_poll_interval=0.05):
+        self.directory = directory
+        self.lock_poll_interval = lock_poll_interval
+        self.reads = 0
+        self.writes = 0
+        self.errors = 0
+        self._usable = None
+
+    def usable(self):
+        """Returns whether snapshots can be shared through the directory,
+        creating it on first use
+        """
+        if self._usable is None:
+            self._usable = self._check_directory()
+        return self._usable
+
+    def _check_directory(self):
+        try:
+            os.makedirs(self.directory, 0o700)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                logger.exception('unable to create snapshot directory {0}'.format(
+                    self.directory))
+                return False
+
+        info = os.lstat(self.directory)
+        if not stat.S_ISDIR(info.st_mode) or \
+                info.st_uid != os.getuid() or \
+                info.st_mode & 0o077:
+            logger.error('not sharing snapshots through {0}, which must be a '
+                         'directory owned by the current user with mode '
+                         '0700'.format(self.directory))
+            return False
+        return True
+
+    def path(self, resource, region, extension='json'):
+        filename = '{0}.{1}.{2}'.format(resource, region, extension)
+        return os.path.join(self.directory, filename)
+
+    @contextlib.contextmanager
+    def lock(self, resource, region):
+        with open(self.path(resource, region, 'lock'), 'a') as f:
+            while True:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except IOError as e:
+                    if e.errno not in (errno.EACCES, errno.EAGAIN):
+                        raise
+                    gevent.sleep(self.lock_poll_interval)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def modified_at(self, resource, region):
+        """Returns when a snapshot was last shared, or ``None`` if it never
+        was
+        """
+        try:
+            return os.stat(self.path(resource, region)).st_mtime
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                self.errors += 1
+                logger.exception('unable to stat {0} snapshot for {1}'.format(
+                    resource, region))
+            return None
+
+    def read(self, resource, region):
+        try:
+            with open(self.path(resource, region)) as f:
+                data = json.load(f)
+                modified_at = os.fstat(f.fileno()).st_mtime
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                self.errors += 1
+                logger.exception('unable to read {0} snapshot for {1}'.format(
+                    resource, region))
+            return None
+        except ValueError:
+            self.errors += 1
+            logger.exception('corrupt {0} snapshot for {1}'.format(
+                resource, region))
+            return None
+
+        if data.get('format_version') != self.format_version:
+            return None
+
+        self.reads += 1
+        snapshot = Snapshot(resource,
+                            region,
+                            data['records'],
+                            fetched_at=data['fetched_at'])
+        snapshot.shared_at = modified_at
+        return snapshot
+
+    def write(self, snapshot):
+        data = {
+            'fetched_at': snapshot.fetched_at,
+            'format_version': self.format_version,
+            'records': snapshot.records,
+        }
+        try:
+            with tempfile.NamedTemporaryFile(dir=self.directory,
+                                             prefix='.tmp-',
+                                             delete=False) as f:
+                json.dump(data, f, separators=(',', ':'), default=to_dict)
+            path = self.path(snapshot.resource, snapshot.region)
+            os.rename(f.name, path)
+            snapshot.shared_at = os.stat(path).st_mtime
+        except (IOError, OSError, TypeError, ValueError):
+            self.errors += 1
+            logger.exception('unable to write {0} snapshot for {1}'.format(
+                snapshot.resource, snapshot.region))
+            return False
+
+        self.writes += 1
+        return True
+
+    def stats(self):
+        return {
+            'directory': self.directory,
+            'errors': self.errors,
+            'reads': self.reads,
+            'usable': self._usable,
+            'writes': self.writes,
+        }
+
+
+class SnapshotStore(object):
+    """Keeps the last good snapshot of each resource type in each region
+
+    Snapshots older than ``refresh_interval`` are still served while a
+    refresh runs in the background (stale-while-revalidate). Snapshots older
+    than ``max_staleness`` are only served when refreshing them fails;
+    otherwise the caller waits on a fresh fetch.
+
+    Each resource type in each region is refreshed on its own, and the last
+    failure to refresh one is kept - see ``error`` - until it is refreshed
+    again, so that a region whose API is failing keeps being served from
+    its last good snapshot while the others are not held back by it.
+    Concurrent fetches of the same snapshot - whether from requests or the
+    background refresh - share a single call to the fetcher. ``start``
+    spawns a scheduler that refreshes snapshots as they come due, so user
+    requests normally never pay for a fetch.
+
+    When given a ``shared`` ``SharedSnapshots``, refreshes first look for a
+    fresh snapshot written by another worker on the same host, and only
+    fetch from AWS - and publish the result - when there is none. A snapshot
+    another worker shares after this one loaded its own - by a forced
+    refresh, say - is reloaded in the background by the next ``get``.
+    """
+
+    def __init__(self,
+                 fetchers,
+                 refresh_interval=None,
+                 max_staleness=None,
+                 shared=None,
+                 indexed_attributes=None,
+                 indexed_tags=None,
+                 search_indexed_attributes=None,
+                 search_indexed_tags=None):
+        if refresh_interval is None:
+            refresh_interval = Config.SNAPSHOT_REFRESH_INTERVAL
+        if max_staleness is None:
+            max_staleness = Config.SNAPSHOT_MAX_STALENESS
+        if indexed_attributes is None:
+            indexed_attributes = Config.INDEXED_ATTRIBUTES
+        if indexed_tags is None:
+            indexed_tags = Config.INDEXED_TAGS
+        if search_indexed_attributes is None:
+            search_indexed_attributes = Config.SEARCH_INDEXED_ATTRIBUTES
+        if search_indexed_tags is None:
+            search_indexed_tags = Config.SEARCH_INDEXED_TAGS
+        self.fetchers = fetchers
+        self.shared = shared
+        self.indexed_attributes = indexed_attributes
+        self.indexed_tags = indexed_tags
+        self.search_indexed_attributes = search_indexed_attributes
+        self.search_indexed_tags = search_indexed_tags
+        self.refresh_interval = refresh_interval
+        self.max_staleness = max_staleness
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.failed_hits = 0
+        self.flight = SingleFlight(detached=True)
+        self.reloads = 0
+        self._failures = {}
+        self._fetch_started = {}
+        self._snapshots = {}
+        self._refreshing = {}
+        self._reloading = {}
+        self._scheduler = None
+
+    def get(self, resource, region):
+        key = (resource, region)
+        snapshot = self._snapshots.get(key)
+        if snapshot is None:
+            self.misses += 1
+            return self.refresh(resource, region)
+
+        if self.shared is not None:
+            self._reload_if_newer(resource, region, snapshot)
+
+        if snapshot.age >= self.max_staleness:
+            if key in self._failures:
+                # rather than have every request wait on a failing region,
+                # serve its last good snapshot while retrying in the
+                # background
+                self.failed_hits += 1
+                self.refresh_async(resource, region)
+                return snapshot
+
+            self.misses += 1
+            try:
+                return self.refresh(resource, region)
+            except Exception:
+                logger.exception('serving stale {0} in {1}'.format(
+                    resource, region))
+                self.failed_hits += 1
+                return snapshot
+
+        self.hits += 1
+        if snapshot.age >= self.refresh_interval:
+            self.stale_hits += 1
+            self.refresh_async(resource, region)
+        return snapshot
+
+    def _reload_if_newer(self, resource, region, snapshot):
+        """Reloads a snapshot in the background when another worker has
+        shared one since it was loaded
+
+        The snapshot in memory keeps being served meanwhile, as reading and
+        indexing a large snapshot takes as long as a request can wait.
+        """
+        if not self.shared.usable():
+            return None
+
+        modified_at = self.shared.modified_at(resource, region)
+        if modified_at is None or \
+                modified_at <= (snapshot.shared_at or snapshot.fetched_at):
+            return None
+        return self.reload_async(resource, region, modified_at)
+
+    def reload_async(self, resource, region, modified_at):
+        key = (resource, region)
+        if key in self._reloading:
+            return self._reloading[key]
+
+        self.reloads += 1
+        greenlet = gevent.spawn(self._reload_in_background,
+                                resource,
+                                region,
+                                modified_at)
+        self._reloading[key] = greenlet
+        return greenlet
+
+    def _reload_in_background(self, resource, region, modified_at):
+        key = (resource, region)
+        try:
+            current = self._snapshots[key]
+            snapshot = self.shared.read(resource, region)
+            if snapshot is None or snapshot.fetched_at <= current.fetched_at:
+                # nothing newer to load; don't look at the same file again
+                current.shared_at = modified_at
+                return
+
+            self._failures.pop(key, None)
+            self._install(snapshot)
+        except Exception:
+            logger.exception('unable to reload {0} in {1}'.format(
+                resource, region))
+        finally:
+            self._reloading.pop(key, None)
+
+    def error(self, resource, region):
+        """Returns the last failure to refresh a snapshot, as a dict of its
+        ``error`` message and the time it ``failed_at``, or ``None`` if the
+        last refresh succeeded
+        """
+        return self._failures.get((resource, region))
+
+    def refresh(self, resource, region, force=False):
+        """Refreshes a snapshot, sharing the call with any concurrent refresh
+
+        A ``force``d refresh fetches from AWS even when a fresh snapshot has
+        been shared by another worker. It still joins a refresh already in
+        flight, and only fetches again if that one did not start fetching
+        after the forced refresh was requested - both ``fetched_at`` and
+        ``failed_at`` are the time the fetch started.
+        """
+        requested_at = time.time()
+        snapshot = self.flight.do((resource, region),
+                                  self._refresh,
+                                  resource,
+                                  region,
+                                  force)
+        if force and snapshot.fetched_at < requested_at:
+            error = self.error(resource, region)
+            if error is None or error['failed_at'] < requested_at:
+                snapshot = self.flight.do((resource, region),
+                                          self._refresh,
+                                          resource,
+                                          region,
+                                          force)
+        return snapshot
+
+    def _refresh(self, resource, region, force=False):
+        key = (resource, region)
+        try:
+            snapshot, error = self._load(resource, region, force)
+        except Exception as e:
+            self._failures[key] = describe_error(
+                e, self._fetch_started.pop(key, None))
+            raise
+
+        failed_at = self._fetch_started.pop(key, None)
+        if error is not None:
+            self._failures[key] = describe_error(error, failed_at)
+            current = self._snapshots.get(key)
+            if current is not None and current.fetched_at >= snapshot.fetched_at:
+                return current
+        else:
+            self._failures.pop(key, None)
+        return self._install(snapshot)
+
+    def _install(self, snapshot):
+        snapshot.build_indexes(self.indexed_attributes, self.indexed_tags)
+        snapshot.build_search_indexes(self.search_indexed_attributes,
+                                      self.search_indexed_tags)
+        self._snapshots[(snapshot.resource, snapshot.region)] = snapshot
+        return snapshot
+
+    def _load(self, resource, region, force=False):
+        """Returns a snapshot along with the error that kept it from being
+        fetched anew, if any
+
+        When fetching fails, the last snapshot shared by any worker is
+        returned instead - however old - so that a worker that has yet to
+        load a snapshot of its own can still serve the region.
+        """
+        if self.shared is None or not self.shared.usable():
+            return self._fetch(resource, region), None
+
+        with self.shared.lock(resource, region):
+            shared = None
+            if not force:
+                shared = self.shared.read(resource, region)
+                if shared is not None and shared.age < self.refresh_interval:
+                    return shared, None
+
+            try:
+                snapshot = self._fetch(resource, region)
+            except Exception as e:
+                if force:
+                    shared = self.shared.read(resource, region)
+                if shared is None:
+                    raise
+                logger.exception('serving shared {0} in {1}'.format(
+                    resource, region))
+                return shared, e
+
+            self.shared.write(snapshot)
+        return snapshot, None
+
+    def _fetch(self, resource, region):
+        # taken before calling the fetcher, so that a snapshot is never
+        # mistaken for one holding changes made while it was being fetched
+        fetched_at = time.time()
+        self._fetch_started[(resource, region)] = fetched_at
+        records = self.fetchers[resource](region)
+        return Snapshot(resource, region, records, fetched_at=fetched_at)
+
+    def refresh_async(self, resource, region):
+        key = (resource, region)
+        if key in self._refreshing:
+            return self._refreshing[key]
+
+        greenlet = gevent.spawn(self._refresh_in_background, resource, region)
+        self._refreshing[key] = greenlet
+        return greenlet
+
+    def _refresh_in_background(self, resource, region):
+        try:
+            self.refresh(resource, region)
+        except Exception:
+            logger.exception('unable to refresh {0} in {1}'.format(
+                resource, region))
+        finally:
+            self._refreshing.pop((resource, region), None)
+
+    def start(self, regions):
+        if self._scheduler is None:
+            self._scheduler = gevent.spawn(self._schedule, regions)
+        return self._scheduler
+
+    def stop(self):
+        if self._scheduler is not None:
+            self._scheduler.kill()
+            self._scheduler = None
+
+    def _schedule(self, regions):
+        tick = max(self.refresh_interval / 10.0, 1)
+        while True:
+            for resource in sorted(self.fetchers):
+                for region in regions:
+                    snapshot = self._snapshots.get((resource, region))
+                    if snapshot is None or snapshot.age >= self.refresh_interval:
+                        self.refresh_async(resource, region)
+            gevent.sleep(tick)
+
+    def state(self, resource, region):
+        """Returns the age, version and refresh state of a snapshot"""
+        snapshot = self._snapshots.get((resource, region))
+        state = {
+            'error': self.error(resource, region),
+            'refreshing': (resource, region) in self._refreshing,
+        }
+        if snapshot is not None:
+            state.update({
+                'age': snapshot.age,
+                'indexes': len(snapshot.indexes),
+                'interned': snapshot.interned,
+                'records': len(snapshot.records),
+                'search_indexes': len(snapshot.search_indexes),
+                'version': snapshot.version,
+            })
+        return state
+
+    def stats(self):
+        snapshots = {}
+        for resource, region in set(self._snapshots) | set(self._failures):
+            snapshots.setdefault(resource, {})[region] = self.state(resource,
+                                                                    region)
+
+        return {
+            'coalesced': self.flight.coalesced,
+            'failed_hits': self.failed_hits,
+            'fetches': self.flight.calls,
+            'hits': self.hits,
+            'misses': self.misses,
+            'reloads': self.reloads,
+            'shared': self.shared.stats() if self.shared else None,
+            'stale_hits': self.stale_hits,
+            'snapshots': snapshots,
+        }
@@ -1,5 +1,16 @@
 import collections
-import json
+import csv
+
+from app.encoding import COMPACT_SEPARATORS
+from app.encoding import INDENT
+from app.encoding import PRETTY_SEPARATORS
+from app.encoding import dumps
+from app.encoding import indent_json
+from app.records import FrozenRecord
+from app.records import Record
+
+
+STREAM_BUFFER_SIZE = 64 * 1024
 
 
 def sorted_dict(data):
@@ -7,8 +18,152 @@ def sorted_dict(data):
         data.items(), key=lambda t: t[0]))
 
 
-def sorted_json(data):
-    return json.dumps(data, sort_keys=True, indent=2, separators=(',', ': ')),
+def sorted_json(data, pretty=True):
+    return dumps(data, pretty=pretty)
+
+
+def render_json(data, pretty=True):
+    """Returns the same document as ``sorted_json``, reusing the JSON each
+    frozen record has already cached instead of encoding it again
+
+    Only the containers around the records - the response envelope, meta
+    and any projected records - are encoded per call.
+    """
+    return ''.join(iter_json(data, pretty=pretty))
+
+
+class EncodedFragment(object):
+    """A piece of a document encoded ahead of time, which ``iter_json``
+    yields as-is in place of encoding the value it stands for
+    """
+
+    __slots__ = ()
+
+
+def iter_json(data, pretty=True, level=0):
+    """Yields the document ``render_json`` returns one piece at a time, so
+    that it can be streamed without ever being held whole in memory
+    """
+    return _iter_json(data, level, pretty)
+
+
+def _iter_json(value, level, pretty):
+    if isinstance(value, EncodedFragment):
+        yield value
+        return
+
+    if isinstance(value, (FrozenRecord, Record)):
+        yield value.to_json(level, pretty=pretty)
+        return
+
+    if isinstance(value, dict):
+        if not value or not _has_nested(value.itervalues()) or \
+                not all(isinstance(k, basestring) for k in value):
+            yield _dump_json(value, level, pretty)
+            return
+        separator = PRETTY_SEPARATORS[1] if pretty else COMPACT_SEPARATORS[1]
+        items = sorted(value.items(), key=lambda kv: kv[0])
+        start, delimiter, end = _delimiters('{', '}', level, pretty)
+        yield start
+        for i, (k, v) in enumerate(items):
+            if i:
+                yield delimiter
+            yield dumps(k) + separator
+            for chunk in _iter_json(v, level + 1, pretty):
+                yield chunk
+        yield end
+        return
+
+    if isinstance(value, (list, tuple)):
+        if not value or not _has_nested(value):
+            yield _dump_json(value, level, pretty)
+            return
+        start, delimiter, end = _delimiters('[', ']', level, pretty)
+        yield start
+        for i, v in enumerate(value):
+            if i:
+                yield delimiter
+            for chunk in _iter_json(v, level + 1, pretty):
+                yield chunk
+        yield end
+        return
+
+    yield _dump_json(value, level, pretty)
+
+
+class Echo(object):
+    """A write-only file that hands back whatever is written to it, letting
+    ``csv.writer`` format rows without buffering them
+    """
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(elements, columns):
+    """Yields a csv header for ``columns`` followed by one row per element
+
+    A ``tag:<key>`` column holds the value of the element's ``<key>`` tag.
+    """
+    writer = csv.writer(Echo())
+    yield writer.writerow([csv_value(column) for column in columns])
+    for element in elements:
+        yield writer.writerow([csv_value(csv_column(element, column))
+                               for column in columns])
+
+
+def csv_column(element, column):
+    if column.startswith('tag:'):
+        return (element.get('tags') or {}).get(column[4:])
+    return element.get(column)
+
+
+def csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (dict, list, tuple)):
+        return dumps(value, pretty=False)
+    return str(value)
+
+
+def buffer_chunks(chunks, size=STREAM_BUFFER_SIZE):
+    """Joins small chunks of a streamed body into chunks of about ``size``
+    bytes, so that each one is not written out on its own
+    """
+    buffered = []
+    buffered_size = 0
+    for chunk in chunks:
+        buffered.append(chunk)
+        buffered_size += len(chunk)
+        if buffered_size >= size:
+            yield ''.join(buffered)
+            buffered = []
+            buffered_size = 0
+    if buffered:
+        yield ''.join(buffered)
+
+
+def _has_nested(values):
+    return any(isinstance(v, (dict, list, tuple, Record, EncodedFragment))
+               for v in values)
+
+
+def _dump_json(value, level, pretty):
+    if pretty:
+        return indent_json(dumps(value), level)
+    return dumps(value, pretty=False)
+
+
+def _delimiters(start, end, level, pretty):
+    if not pretty:
+        return start, COMPACT_SEPARATORS[0], end
+    inner = '\n' + ' ' * (INDENT * (level + 1))
+    outer = '\n' + ' ' * (INDENT * level)
+    return start + inner, PRETTY_SEPARATORS[0] + inner, outer + end
 
 
 def to_bool(s):
@@ -25,3 +180,9 @@ def to_bool(s):
             return False
 
     return bool(s) is True
+
+
+def to_utf8(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
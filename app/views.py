@@ -1,8 +1,10 @@
 import gevent.monkey
 gevent.monkey.patch_all()  # noqa
 
+import base64
 import boto3
 import botocore
+import hashlib
 import json
 import time
 
@@ -11,22 +13,40 @@ from flask import jsonify
 from flask import request
 from flask import Response
 
+from app.aws import count_by_group
 from app.aws import format_elements
 from app.aws import get_amis
 from app.aws import get_instance_types
 from app.aws import get_nodes
 from app.aws import get_rds_instances
 from app.aws import get_regions
+from app.aws import get_resources
 from app.aws import get_status
-from app.aws import limit_elements
+from app.aws import page_elements
+from app.aws import refresh_snapshots
+from app.aws import resource_pool
+from app.aws import snapshot_store
 from app.aws import sort_by_group
+from app.basic_auth import requires_admin_auth
 from app.basic_auth import requires_auth
+from app.cache import ResultCache
+from app.cache import cache_stats
+from app.columns import columnar_filters_available
+from app.compression import PrecompressedBodies
+from app.compression import available_encodings
+from app.compression import compress
+from app.compression import negotiate
 from app.config import Config
+from app.fanout import RegionTimeout
 from app.log import getLogger
 from app.log import getRequestLogger
 from app.log import log_request
 from app.ssl_279 import _ssl
-from app.utils import sorted_json
+from app.utils import buffer_chunks
+from app.utils import iter_csv
+from app.utils import iter_json
+from app.utils import render_json
+from app.utils import to_bool
 
 _ssl  # hack to avoid "Imported but not used" validation issue
 blueprint_http = Blueprint('blueprint_http', __name__)
@@ -35,6 +55,10 @@ request_logger = getRequestLogger()
 aws_docs_domain = 'http://docs.aws.amazon.com'
 error_link = '{0}/AWSEC2/latest/APIReference/errors-overview.html'.format(
     aws_docs_domain)
+precompressed_bodies = PrecompressedBodies()
+result_cache = ResultCache()
+
+PRECOMPRESSIBLE_ARGS = set(['count', 'format', 'pretty', 'region'])
 
 
 @blueprint_http.app_errorhandler(404)
@@ -82,6 +106,18 @@ def handle_lookup_error(error):
     return response
 
 
+@blueprint_http.errorhandler(RegionTimeout)
+def handle_region_timeout(error):
+    logger.info('RegionTimeout: {0}'.format(error))
+    response = jsonify({
+        'title': 'Timed out retrieving region {0}'.format(error.region),
+        'detail': '{0}'.format(error),
+        'status': 504,
+    })
+    response.status_code = 504
+    return response
+
+
 @blueprint_http.after_request
 def log_http_request(response):
     log_request(request, response, request_logger)
@@ -98,9 +134,37 @@ def status():
                 'cache': {
                     'expiration': Config.CACHE_EXPIRATION,
                     'size': Config.CACHE_SIZE
+                },
+                'compression': {
+                    'encodings': available_encodings(),
+                    'level': Config.COMPRESSION_LEVEL,
+                    'precompressed_bodies': Config.PRECOMPRESSED_BODIES
+                },
+                'resource_pool': {
+                    'size': Config.RESOURCE_POOL_SIZE
+                },
+                'result_cache': {
+                    'max_elements': Config.RESULT_CACHE_MAX_ELEMENTS,
+                    'size': Config.RESULT_CACHE_SIZE
+                },
+                'fan_out': {
+                    'concurrency': Config.REGION_CONCURRENCY,
+                    'timeout': Config.REGION_TIMEOUT
+                },
+                'snapshots': {
+                    'background_refresh': Config.SNAPSHOT_BACKGROUND_REFRESH,
+                    'columnar_filters': columnar_filters_available(),
+                    'directory': Config.SNAPSHOT_DIR,
+                    'max_staleness': Config.SNAPSHOT_MAX_STALENESS,
+                    'refresh_interval': Config.SNAPSHOT_REFRESH_INTERVAL
                 }
             },
+            'cache': cache_stats(),
+            'precompressed_bodies': precompressed_bodies.stats(),
             'environment': 'dev' if Config.DEBUG else 'prod',
+            'resource_pool': resource_pool.stats(),
+            'result_cache': result_cache.stats(),
+            'snapshots': snapshot_store.stats(),
             'name': 'haldane'
         },
         'meta': {
@@ -110,36 +174,71 @@ def status():
     })
 
 
+@blueprint_http.route('/_refresh', methods=['POST'])
+@blueprint_http.route('/_refresh/<resource>', methods=['POST'])
+@blueprint_http.route('/_refresh/<resource>/<region>', methods=['POST'])
+@requires_admin_auth
+def refresh(resource=None, region=None):
+    time_start = time.time()
+    resources = get_resources(request.args.get('resource', resource))
+    regions = get_regions(request.args.get('region', region))
+    snapshots = refresh_snapshots(resources, regions)
+
+    ok = not any(state['error']
+                 for states in snapshots.values()
+                 for state in states.values())
+    response = json_response({
+        'meta': {
+            'regions': regions,
+            'resources': resources,
+            'status': 200 if ok else 502,
+            'took': time.time() - time_start,
+        },
+        'ok': ok,
+        'snapshots': snapshots,
+    })
+    response.status_code = 200 if ok else 502
+    return response
+
+
 @blueprint_http.route('/amis')
 @requires_auth
 def amis():
     time_start = time.time()
     query = request.args.get('query', request.args.get('q'))
     regions = get_regions(request.args.get('region'))
-    amis = get_amis(request.args, regions, query)
-
-    total_amis = len(amis)
-    amis = limit_elements(amis, limit=request.args.get('limit'))
-    total_not_hidden = len(amis)
-    amis = format_elements(
-        amis,
-        fields=request.args.get('fields'),
-        format=request.args.get('format'))
-    total_hidden = total_not_hidden - len(amis)
+    amis, fetch_meta = get_amis(request.args, regions, query)
+    etag = get_etag(amis)
+    if request.if_none_match.contains_weak(etag):
+        return not_modified(etag)
+
+    precompression_key = get_precompression_key(amis)
+    (amis,
+     total_amis,
+     total_is_estimate,
+     total_hidden,
+     pagination) = get_listing(amis)
 
     if request.args.get('format') == 'csv':
-        return csv_response(amis)
+        return csv_response(amis, etag=etag)
+    if request.args.get('format') == 'ndjson':
+        return ndjson_response(amis, etag=etag)
+
+    meta = {
+        'took': time.time() - time_start,
+        'total': total_amis,
+        'total_is_estimate': total_is_estimate,
+        'hidden_nodes': total_hidden,
+        'regions': regions,
+        'per_page': len(amis)
+    }
+    meta.update(fetch_meta)
+    meta.update(pagination)
 
     return json_response({
-        'meta': {
-            'took': time.time() - time_start,
-            'total': total_amis,
-            'hidden_nodes': total_hidden,
-            'regions': regions,
-            'per_page': len(amis)
-        },
+        'meta': meta,
         'amis': amis,
-    })
+    }, precompress=('amis', precompression_key), etag=etag)
 
 
 @blueprint_http.route('/instance-types')
@@ -172,32 +271,35 @@ def nodes_by_group(group=None):
     query = request.args.get('query', request.args.get('q'))
     regions = get_regions(request.args.get('region'))
     status = get_status(request.args.get('status'))
-    nodes = get_nodes(request.args,
-                      regions,
-                      query,
-                      status=status)
-    groups = sort_by_group(nodes, group=group)
-
-    total_hidden = 0
-    _groups = {}
-    for group, nodes in groups.items():
-        total_nodes = len(nodes)
-        _groups[group] = format_elements(
-            nodes,
-            fields=request.args.get('fields'),
-            format=request.args.get('format', 'dict'))
-        total_hidden += total_nodes - len(_groups[group])
+    nodes, fetch_meta = get_nodes(request.args,
+                                  regions,
+                                  query,
+                                  status=status)
+    etag = get_etag(nodes)
+    if request.if_none_match.contains_weak(etag):
+        return not_modified(etag)
+
+    if to_bool(request.args.get('counts', False)):
+        _groups = count_by_group(nodes, group=group)
+        total_hidden = 0
+    else:
+        _groups, total_hidden = result_cache.get(
+            get_result_key(nodes),
+            lambda: format_groups(nodes, group))
+
+    meta = {
+        'took': time.time() - time_start,
+        'total': len(_groups),
+        'hidden_nodes': total_hidden,
+        'regions': regions,
+        'per_page': len(_groups)
+    }
+    meta.update(fetch_meta)
 
     return json_response({
-        'meta': {
-            'took': time.time() - time_start,
-            'total': len(groups),
-            'hidden_nodes': total_hidden,
-            'regions': regions,
-            'per_page': len(groups)
-        },
+        'meta': meta,
         'groups': _groups
-    })
+    }, etag=etag)
 
 
 @blueprint_http.route('/instances')
@@ -210,33 +312,41 @@ def nodes(region=None):
     query = request.args.get('query', request.args.get('q'))
     regions = get_regions(request.args.get('region', region))
     status = get_status(request.args.get('status'))
-    nodes = get_nodes(request.args,
-                      regions,
-                      query,
-                      status=status)
-
-    total_nodes = len(nodes)
-    nodes = limit_elements(nodes, limit=request.args.get('limit'))
-    total_not_hidden = len(nodes)
-    nodes = format_elements(
-        nodes,
-        fields=request.args.get('fields'),
-        format=request.args.get('format'))
-    total_hidden = total_not_hidden - len(nodes)
+    nodes, fetch_meta = get_nodes(request.args,
+                                  regions,
+                                  query,
+                                  status=status)
+    etag = get_etag(nodes)
+    if request.if_none_match.contains_weak(etag):
+        return not_modified(etag)
+
+    precompression_key = get_precompression_key(nodes)
+    (nodes,
+     total_nodes,
+     total_is_estimate,
+     total_hidden,
+     pagination) = get_listing(nodes)
 
     if request.args.get('format') == 'csv':
-        return csv_response(nodes)
+        return csv_response(nodes, etag=etag)
+    if request.args.get('format') == 'ndjson':
+        return ndjson_response(nodes, etag=etag)
+
+    meta = {
+        'took': time.time() - time_start,
+        'total': total_nodes,
+        'total_is_estimate': total_is_estimate,
+        'hidden_nodes': total_hidden,
+        'regions': regions,
+        'per_page': len(nodes)
+    }
+    meta.update(fetch_meta)
+    meta.update(pagination)
 
     return json_response({
-        'meta': {
-            'took': time.time() - time_start,
-            'total': total_nodes,
-            'hidden_nodes': total_hidden,
-            'regions': regions,
-            'per_page': len(nodes)
-        },
-        'nodes': nodes
-    })
+        'meta': meta,
+        'nodes': nodes,
+    }, precompress=('nodes', precompression_key), etag=etag)
 
 
 @blueprint_http.route('/rds-instances')
@@ -247,63 +357,308 @@ def rds_instances(region=None):
     query = request.args.get('query', request.args.get('q'))
     regions = get_regions(request.args.get('region', region))
     status = get_status(request.args.get('status'))
-    rds_instances = get_rds_instances(request.args,
-                                      regions,
-                                      query,
-                                      status=status)
-
-    total_rds_instances = len(rds_instances)
-    rds_instances = limit_elements(rds_instances,
-                                   limit=request.args.get('limit'))
-    total_not_hidden = len(rds_instances)
-    rds_instances = format_elements(
-        rds_instances,
-        fields=request.args.get('fields'),
-        format=request.args.get('format'))
-    total_hidden = total_not_hidden - len(rds_instances)
+    rds_instances, fetch_meta = get_rds_instances(request.args,
+                                                  regions,
+                                                  query,
+                                                  status=status)
+    etag = get_etag(rds_instances)
+    if request.if_none_match.contains_weak(etag):
+        return not_modified(etag)
+
+    precompression_key = get_precompression_key(rds_instances)
+    (rds_instances,
+     total_rds_instances,
+     total_is_estimate,
+     total_hidden,
+     pagination) = get_listing(rds_instances)
 
     if request.args.get('format') == 'csv':
-        return csv_response(rds_instances)
+        return csv_response(rds_instances, etag=etag)
+    if request.args.get('format') == 'ndjson':
+        return ndjson_response(rds_instances, etag=etag)
+
+    meta = {
+        'took': time.time() - time_start,
+        'total': total_rds_instances,
+        'total_is_estimate': total_is_estimate,
+        'hidden_rds_instances': total_hidden,
+        'regions': regions,
+        'per_page': len(rds_instances)
+    }
+    meta.update(fetch_meta)
+    meta.update(pagination)
 
     return json_response({
-        'meta': {
-            'took': time.time() - time_start,
-            'total': total_rds_instances,
-            'hidden_rds_instances': total_hidden,
-            'regions': regions,
-            'per_page': len(rds_instances)
-        },
-        'rds-instances': rds_instances
-    })
-    pass
+        'meta': meta,
+        'rds-instances': rds_instances,
+    }, precompress=('rds-instances', precompression_key), etag=etag)
+
+
+def get_listing(elements):
+    """Returns the page of ``elements`` the request asks for, formatted,
+    along with the total number of elements, whether that total is an
+    estimate, the number of elements hidden by name collisions and the
+    pagination meta of the page
+
+    Results are kept in ``result_cache`` for subsequent identical requests.
+    """
+    return result_cache.get(get_result_key(elements),
+                            lambda: format_listing(elements))
+
+
+def format_listing(elements):
+    count = to_bool(request.args.get('count', True))
+    limit = parse_limit(request.args.get('limit'))
+    pagination = {}
+    if limit is None:
+        elements = list(elements)
+        total = len(elements)
+    else:
+        version = versions_digest(elements)
+        cursor = request.args.get('cursor')
+        after = None
+        if cursor:
+            after, cursor_version = decode_cursor(cursor)
+            pagination['cursor_is_stale'] = cursor_version != version
+        elements, total, after = page_elements(elements,
+                                               limit,
+                                               after=after,
+                                               count=count)
+        pagination['next'] = None
+        if after is not None:
+            pagination['next'] = encode_cursor(after, version)
+
+    total_not_hidden = len(elements)
+    elements = format_elements(
+        elements,
+        fields=request.args.get('fields'),
+        format=request.args.get('format'))
+    total_is_estimate = not count and total > total_not_hidden
+    total_hidden = total_not_hidden - len(elements)
+    result = (elements, total, total_is_estimate, total_hidden, pagination)
+    return result, len(elements)
 
 
-def json_response(data):
-    return Response(
-        sorted_json(data),
-        mimetype='application/json',
-    )
+def encode_cursor(after, version):
+    """Returns an opaque cursor for the page following the ``(region, id)``
+    pair ``after``, in a listing of snapshots at ``version``
+    """
+    region, id = after
+    return base64.urlsafe_b64encode(json.dumps([region, id, version]))
 
 
-def csv_response(data):
-    resp = []
-    header = []
-    fields = request.args.get('fields')
-    for instance, data in data.items():
-        header = data.keys()
-        values = data.values()
-        if fields:
-            values = []
-            for field in fields.split(','):
-                values.append(str(data.get(field, '')))
-        resp.append(','.join(values))
+def parse_limit(limit):
+    if limit is None:
+        return None
+    try:
+        limit = int(limit)
+    except ValueError:
+        limit = -1
+    if limit < 0:
+        raise LookupError('Invalid limit querystring argument passed')
+    return limit
 
-    if fields:
-        header = [fields]
-    else:
-        header = [','.join(header)]
 
-    return Response(
-        "\n".join(header + resp),
-        mimetype="text/csv"
-    )
+def decode_cursor(cursor):
+    try:
+        region, id, version = json.loads(base64.urlsafe_b64decode(str(cursor)))
+    except (TypeError, ValueError):
+        raise LookupError('Invalid cursor querystring argument passed')
+    return (region, id), version
+
+
+def versions_digest(elements):
+    return hashlib.sha1(repr(snapshot_versions(elements))).hexdigest()[:16]
+
+
+def format_groups(nodes, group=None):
+    groups = sort_by_group(nodes, group=group)
+
+    total_hidden = 0
+    total_formatted = 0
+    _groups = {}
+    for group, nodes in groups.items():
+        total_nodes = len(nodes)
+        _groups[group] = format_elements(
+            nodes,
+            fields=request.args.get('fields'),
+            format=request.args.get('format', 'dict'))
+        total_hidden += total_nodes - len(_groups[group])
+        total_formatted += len(_groups[group])
+    return (_groups, total_hidden), total_formatted
+
+
+def get_result_key(elements):
+    return (request.endpoint, canonical_query()) + snapshot_versions(elements)
+
+
+def snapshot_versions(elements):
+    return tuple((snapshot.resource, snapshot.region, snapshot.version)
+                 for snapshot in elements.snapshots)
+
+
+def json_response(data, precompress=None, etag=None):
+    """Streams ``data`` as JSON
+
+    ``precompress`` is a pair of the name of the collection in ``data`` and
+    the key its gzipped JSON is cached under between requests, as returned
+    by ``get_precompression_key``. When gzip is negotiated, a cached
+    collection is only compressed once per snapshot version.
+    """
+    pretty = wants_pretty()
+    encoding = negotiate_encoding()
+    if precompress is not None and encoding == 'gzip':
+        name, key = precompress
+        if key is not None:
+            collection = data[name]
+            data = dict(data)
+            data[name] = precompressed_bodies.get(
+                key + (pretty,),
+                lambda: iter_json(collection, pretty=pretty, level=1))
+
+    response = stream_response(iter_json(data, pretty=pretty),
+                               'application/json',
+                               encoding,
+                               etag=etag)
+    response.vary.add('Accept')
+    return response
+
+
+def stream_response(chunks, mimetype, encoding=None, etag=None):
+    if encoding is not None:
+        chunks = compress(chunks, encoding)
+    response = Response(buffer_chunks(chunks), mimetype=mimetype)
+    if encoding is not None:
+        response.content_encoding = encoding
+    if etag is not None:
+        response.set_etag(etag, weak=True)
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def not_modified(etag):
+    response = Response(status=304)
+    response.set_etag(etag, weak=True)
+    response.vary.add('Accept')
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def get_etag(elements):
+    """Returns the entity tag of a listing of ``elements``
+
+    The tag covers the endpoint, the canonical query and the version of
+    every snapshot the elements come from, so it only changes when the
+    request or the content of a snapshot does. It is weak, as ``meta``
+    timings differ between otherwise identical responses.
+    """
+    key = (request.endpoint, wants_pretty(), canonical_query())
+    return hashlib.sha1(repr(key + snapshot_versions(elements))).hexdigest()
+
+
+def canonical_query():
+    """Returns the arguments of the request in a canonical form
+
+    Only the first value of each querystring argument is ever used, ``q``
+    is an alias of ``query``, and a ``region`` querystring argument takes
+    precedence over the region in the path.
+    """
+    args = request.args.to_dict()
+    view_args = dict(request.view_args or {})
+    if 'q' in args:
+        args.setdefault('query', args.pop('q'))
+    if 'region' in view_args:
+        args.setdefault('region', view_args.pop('region'))
+    return tuple(sorted(args.items())), tuple(sorted(view_args.items()))
+
+
+def negotiate_encoding():
+    return negotiate(request.accept_encodings)
+
+
+def get_precompression_key(elements):
+    """Returns the key of the precompressed body of an unfiltered listing,
+    or ``None`` if the request narrows or reshapes the listing
+
+    Only querystring arguments that leave the set of records untouched are
+    allowed, and the key covers the requested format and the version of
+    every snapshot the records come from.
+    """
+    if not set(request.args) <= PRECOMPRESSIBLE_ARGS or not elements.unfiltered:
+        return None
+
+    format = request.args.get('format', 'dict')
+    if format not in ['dict', 'list']:
+        return None
+
+    return (request.endpoint, format) + snapshot_versions(elements)
+
+
+def wants_pretty():
+    """Whether to indent the JSON response body
+
+    Clients ask for compact JSON with ``pretty=false``, either in the
+    querystring or as a parameter of the ``application/json`` media type in
+    the ``Accept`` header. Indented JSON remains the default.
+    """
+    if 'pretty' in request.args:
+        return to_bool(request.args['pretty'])
+
+    for media_range, _ in request.accept_mimetypes:
+        mimetype, _, params = media_range.partition(';')
+        if mimetype.strip() != 'application/json':
+            continue
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip() == 'pretty':
+                return to_bool(value.strip().strip('"'))
+    return True
+
+
+def ndjson_response(data, etag=None):
+    """Streams records as newline-delimited compact JSON, one per line"""
+    def generate():
+        for element in data:
+            yield render_json(element, pretty=False) + '\n'
+
+    return stream_response(generate(),
+                           'application/x-ndjson',
+                           negotiate_encoding(),
+                           etag=etag)
+
+
+def csv_response(data, etag=None):
+    elements = data.values() if isinstance(data, dict) else data
+    columns = csv_columns(elements,
+                          fields=request.args.get('fields'),
+                          flatten_tags=to_bool(request.args.get('flatten_tags', False)))
+
+    return stream_response(iter_csv(elements, columns),
+                           'text/csv',
+                           negotiate_encoding(),
+                           etag=etag)
+
+
+def csv_columns(elements, fields=None, flatten_tags=False):
+    """Returns the columns of a csv response, in order
+
+    Requested ``fields`` are used as-is. Otherwise every attribute found on
+    any element is used in sorted order, as some resources only set optional
+    attributes on some of their records. With ``flatten_tags``, the ``tags``
+    column is replaced with a ``tag:<key>`` column per tag key found on any
+    element.
+    """
+    if fields:
+        return fields.split(',')
+
+    keys = set()
+    for element in elements:
+        keys.update(element)
+    columns = sorted(keys)
+    if flatten_tags and 'tags' in columns:
+        tag_keys = set()
+        for element in elements:
+            tag_keys.update(element.get('tags') or {})
+        columns.remove('tags')
+        columns.extend('tag:{0}'.format(key) for key in sorted(tag_keys))
+    return columns
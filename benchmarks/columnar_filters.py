@@ -0,0 +1,54 @@
+"""
+Times filtering a 50k record snapshot by scanning it record by record
+versus evaluating the predicates over its columns. Requires numpy.
+
+    python -m benchmarks.columnar_filters
+"""
+import time
+
+import werkzeug
+
+from app.filters import FilteredElements
+from app.filters import compile_filters
+from app.snapshots import Snapshot
+from benchmarks.format_elements import records_fixture
+
+
+FILTERS = [
+    {'starts-with.name': 'www-4'},
+    {'ends-with.name': '99'},
+    {'substring.name': '123'},
+    {'not-substring.name': '1', 'tags.environment': 'production'},
+    {'in-list.id': 'i-00000001,i-00000002,i-00000003'},
+]
+
+
+def run(snapshot, args, repeat=5):
+    plan = compile_filters(werkzeug.datastructures.ImmutableMultiDict(args))
+    time_start = time.time()
+    for _ in range(repeat):
+        count = sum(1 for _ in FilteredElements(plan, [snapshot]))
+    return (time.time() - time_start) / repeat, count
+
+
+def main():
+    snapshot = Snapshot('nodes', 'us-east-1', records_fixture(50000))
+    columns = snapshot.columns
+    if columns is None:
+        raise SystemExit('columnar filters need numpy and COLUMNAR_FILTERS')
+
+    print('{0:>48} {1:>8} {2:>10} {3:>12}'.format(
+        'filters', 'matches', 'scan (s)', 'columns (s)'))
+    for args in FILTERS:
+        snapshot.columns = None
+        scanned, count = run(snapshot, args)
+        snapshot.columns = columns
+        run(snapshot, args, repeat=1)
+        columnar, _ = run(snapshot, args)
+        print('{0:>48} {1:>8} {2:>10.4f} {3:>12.4f}'.format(
+            ' '.join('{0}={1}'.format(*item) for item in sorted(args.items())),
+            count, scanned, columnar))
+
+
+if __name__ == '__main__':
+    main()
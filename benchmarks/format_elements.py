@@ -0,0 +1,61 @@
+"""
+Measures how long shaping a response out of snapshot records takes and how
+much memory each response allocates, with and without ``fields``. Records
+handed back as-is are shared with the snapshot and cost nothing; projections
+are counted at their full size.
+
+    python -m benchmarks.format_elements
+"""
+import sys
+import time
+
+from app.aws import format_elements
+from app.snapshots import Snapshot
+
+
+def records_fixture(count):
+    return [{
+        'group': 'www',
+        'id': 'i-{0:08x}'.format(i),
+        'instance_type': 'm4.large',
+        'ip': '10.0.{0}.{1}'.format(i // 256 % 256, i % 256),
+        'name': 'www-{0}'.format(i),
+        'region': 'us-east-1',
+        'status': 'running',
+        'tags': {'Name': 'www-{0}'.format(i), 'environment': 'production'},
+    } for i in range(count)]
+
+
+def allocated_size(body, records):
+    shared = set(id(record) for record in records)
+    values = body.values() if isinstance(body, dict) else body
+    size = sys.getsizeof(body)
+    for value in values:
+        if id(value) not in shared:
+            size += sys.getsizeof(value)
+    return size
+
+
+def run(records, fields, format, repeat=5):
+    timings = []
+    for _ in range(repeat):
+        time_start = time.time()
+        body = format_elements(records, fields=fields, format=format)
+        timings.append(time.time() - time_start)
+    return min(timings), allocated_size(body, records)
+
+
+def main():
+    print('{0:>8} {1:>6} {2:>10} {3:>10} {4:>10}'.format(
+        'records', 'format', 'fields', 'time (s)', 'KiB'))
+    for count in [1000, 10000, 50000]:
+        records = Snapshot('nodes', 'us-east-1', records_fixture(count)).records
+        for format in ['dict', 'list']:
+            for fields in [None, 'id,name']:
+                elapsed, allocated = run(records, fields, format)
+                print('{0:>8} {1:>6} {2:>10} {3:>10.4f} {4:>10}'.format(
+                    count, format, fields or '-', elapsed, allocated // 1024))
+
+
+if __name__ == '__main__':
+    main()
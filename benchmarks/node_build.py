@@ -0,0 +1,87 @@
+"""
+Times how long materializing a region's nodes takes for growing numbers of
+instances and self-owned amis, resolving each instance's ``image_name``
+through the id-keyed ami index versus the linear scan it replaced.
+
+    python -m benchmarks.node_build
+"""
+import datetime
+import time
+
+from app.aws import _fetch_nodes_in_region
+
+
+class FakeInstance(object):
+    def __init__(self, i, image_count):
+        self.instance_id = 'i-{0:08x}'.format(i)
+        self.image_id = 'ami-{0:08x}'.format(i % image_count)
+        self.iam_instance_profile = None
+        self.instance_type = 'm4.large'
+        self.launch_time = datetime.datetime(2016, 8, 27, 20, 58)
+        self.placement = {'AvailabilityZone': 'us-east-1a'}
+        self.private_ip_address = '10.0.{0}.{1}'.format(i // 256 % 256, i % 256)
+        self.public_ip_address = None
+        self.state = {'Name': 'running'}
+        self.tags = [
+            {'Key': 'Name', 'Value': 'www-{0}'.format(i)},
+            {'Key': 'aws:autoscaling:groupName', 'Value': 'www'},
+            {'Key': 'environment', 'Value': 'production'},
+        ]
+        self.vpc_id = 'vpc-8675309'
+
+
+class FakeCollection(object):
+    def __init__(self, items):
+        self.items = items
+
+    def all(self):
+        return self.items
+
+
+class FakeResource(object):
+    def __init__(self, instances):
+        self.instances = FakeCollection(instances)
+
+
+class ScanIndex(object):
+    """Resolves amis the way node building did before the id index"""
+
+    def __init__(self, images):
+        self.images = images
+
+    def get(self, image_id):
+        matches = [image for image in self.images if image['id'] == image_id]
+        if len(matches) == 1:
+            return matches[0]
+        return None
+
+
+def run(instance_count, image_count):
+    images = [{'id': 'ami-{0:08x}'.format(i), 'name': 'BaseAMI-{0}'.format(i)}
+              for i in range(image_count)]
+    resource = FakeResource([FakeInstance(i, image_count)
+                             for i in range(instance_count)])
+
+    timings = []
+    for index in (dict((image['id'], image) for image in images),
+                  ScanIndex(images)):
+        time_start = time.time()
+        _fetch_nodes_in_region(resource, 'us-east-1', frozenset(), index)
+        timings.append(time.time() - time_start)
+    return timings
+
+
+def main():
+    print('{0:>10} {1:>10} {2:>12} {3:>12}'.format(
+        'instances', 'amis', 'index (s)', 'scan (s)'))
+    for instance_count, image_count in [(500, 250),
+                                        (1000, 500),
+                                        (2000, 1000),
+                                        (4000, 2000)]:
+        indexed, scanned = run(instance_count, image_count)
+        print('{0:>10} {1:>10} {2:>12.4f} {3:>12.4f}'.format(
+            instance_count, image_count, indexed, scanned))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Measures the resident memory taken by 10k instance records when kept as
+fetched (``OrderedDict``), as frozen dicts, as compact ``Record``s, and as
+``Record``s sharing their strings and tag sets through an ``Interner``. Each
+representation is measured in a fresh interpreter. Records are decoded from
+JSON, so that each holds its own strings, as when parsed from an AWS
+response or a shared snapshot.
+
+    python -m benchmarks.record_memory
+"""
+import collections
+import gc
+import json
+import subprocess
+import sys
+
+import psutil
+
+from app.aws import _fetch_nodes_in_region
+from app.records import Interner
+from app.records import freeze
+from app.records import make_record
+from benchmarks.node_build import FakeInstance
+from benchmarks.node_build import FakeResource
+
+
+def interned_records():
+    interner = Interner()
+    return lambda record: make_record(record, interner)
+
+
+REPRESENTATIONS = {
+    'ordered-dict': lambda: lambda record: record,
+    'frozen-dict': lambda: freeze,
+    'record': lambda: make_record,
+    'interned-record': interned_records,
+}
+
+
+def measure(representation, instance_count, chunk_size=100):
+    convert = REPRESENTATIONS[representation]()
+    images = dict(('ami-{0:08x}'.format(i), {'name': 'BaseAMI-{0}'.format(i)})
+                  for i in range(50))
+    instances = [FakeInstance(i, 50) for i in range(instance_count)]
+
+    gc.collect()
+    process = psutil.Process()
+    rss_before = process.memory_info().rss
+
+    records = []
+    for start in range(0, instance_count, chunk_size):
+        resource = FakeResource(instances[start:start + chunk_size])
+        fetched = json.loads(json.dumps(_fetch_nodes_in_region(
+            resource, 'us-east-1', frozenset(), images)),
+            object_pairs_hook=collections.OrderedDict)
+        records.extend(convert(record) for record in fetched)
+
+    convert = None
+    gc.collect()
+    return process.memory_info().rss - rss_before
+
+
+def main():
+    if len(sys.argv) == 3:
+        print(measure(sys.argv[1], int(sys.argv[2])))
+        return
+
+    instance_count = 10000
+    print('{0:>14} {1:>16}'.format('representation', 'MiB / 10k nodes'))
+    for representation in ['ordered-dict', 'frozen-dict', 'record',
+                           'interned-record']:
+        output = subprocess.check_output([
+            sys.executable, '-m', 'benchmarks.record_memory',
+            representation, str(instance_count)])
+        rss = int(output.strip().splitlines()[-1])
+        print('{0:>14} {1:>16.1f}'.format(
+            representation, rss / 1024.0 / 1024 * 10000 / instance_count))
+
+
+if __name__ == '__main__':
+    main()
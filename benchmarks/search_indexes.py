@@ -0,0 +1,56 @@
+"""
+Times answering name searches on a 50k record snapshot by scanning it
+versus through its search index, and how long building the index takes.
+
+    python -m benchmarks.search_indexes
+"""
+import time
+
+import werkzeug
+
+from app.filters import FilteredElements
+from app.filters import compile_filters
+from app.snapshots import Snapshot
+from benchmarks.format_elements import records_fixture
+
+
+FILTERS = [
+    {'starts-with.name': 'www-4999'},
+    {'ends-with.name': '999'},
+    {'substring.name': '1234'},
+    {'q': 'www-123'},
+]
+
+
+def run(snapshot, args, repeat=5):
+    args = werkzeug.datastructures.ImmutableMultiDict(args)
+    plan = compile_filters(args, query=args.get('q'))
+    time_start = time.time()
+    for _ in range(repeat):
+        count = sum(1 for _ in FilteredElements(plan, [snapshot]))
+    return (time.time() - time_start) / repeat, count
+
+
+def main():
+    snapshot = Snapshot('nodes', 'us-east-1', records_fixture(50000))
+    snapshot.columns = None
+
+    time_start = time.time()
+    snapshot.build_search_indexes(['name'])
+    print('built name index in {0:.2f}s'.format(time.time() - time_start))
+    search_indexes = snapshot.search_indexes
+
+    print('{0:>24} {1:>8} {2:>10} {3:>10}'.format(
+        'filters', 'matches', 'scan (s)', 'index (s)'))
+    for args in FILTERS:
+        snapshot.search_indexes = {}
+        scanned, count = run(snapshot, args)
+        snapshot.search_indexes = search_indexes
+        searched, _ = run(snapshot, args)
+        print('{0:>24} {1:>8} {2:>10.4f} {3:>10.4f}'.format(
+            ' '.join('{0}={1}'.format(*item) for item in sorted(args.items())),
+            count, scanned, searched))
+
+
+if __name__ == '__main__':
+    main()
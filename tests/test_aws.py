@@ -0,0 +1,86 @@
+import boto3
+import pytest
+import werkzeug
+
+from botocore.exceptions import ClientError
+from botocore.stub import Stubber
+
+from app.aws import _get_rds_tags_for_instance
+from app.aws import _get_rds_tags_from_tagging_api
+from app.aws import count_by_group
+from app.aws import sort_by_group
+from app.filters import FilteredElements
+from app.filters import compile_filters
+from app.snapshots import Snapshot
+from tests.test_filters import elements_fixture
+
+ARN = 'arn:aws:rds:us-east-1:123456789012:db:www'
+
+
+def test_get_rds_tags_from_tagging_api():
+    client = boto3.client('resourcegroupstaggingapi', region_name='us-east-1')
+    with Stubber(client) as stubber:
+        stubber.add_response('get_resources', {
+            'PaginationToken': 'page-2',
+            'ResourceTagMappingList': [{
+                'ResourceARN': ARN,
+                'Tags': [{'Key': 'environment', 'Value': 'production'}],
+            }],
+        }, {'ResourceTypeFilters': ['rds:db']})
+        stubber.add_response('get_resources', {
+            'PaginationToken': '',
+            'ResourceTagMappingList': [{
+                'ResourceARN': ARN.replace('www', 'api'),
+                'Tags': [],
+            }],
+        }, {'ResourceTypeFilters': ['rds:db'], 'PaginationToken': 'page-2'})
+
+        tags = _get_rds_tags_from_tagging_api(client)
+
+    assert tags == {
+        ARN: {'environment': 'production'},
+        ARN.replace('www', 'api'): {},
+    }
+
+
+def test_get_rds_tags_for_instance_retries_throttling():
+    client = boto3.client('rds', region_name='us-east-1')
+    with Stubber(client) as stubber:
+        stubber.add_client_error('list_tags_for_resource', 'Throttling')
+        stubber.add_response('list_tags_for_resource', {
+            'TagList': [{'Key': 'environment', 'Value': 'staging'}],
+        }, {'ResourceName': ARN})
+
+        tags = _get_rds_tags_for_instance(client, ARN, retries=1, backoff=0)
+
+    assert tags == {'environment': 'staging'}
+
+
+def test_get_rds_tags_for_instance_gives_up():
+    client = boto3.client('rds', region_name='us-east-1')
+    with Stubber(client) as stubber:
+        stubber.add_client_error('list_tags_for_resource', 'Throttling')
+        stubber.add_client_error('list_tags_for_resource', 'Throttling')
+
+        with pytest.raises(ClientError):
+            _get_rds_tags_for_instance(client, ARN, retries=1, backoff=0)
+
+
+def test_sort_by_group_partitions_snapshots():
+    snapshots = []
+    for region in ['us-east-1', 'us-west-1']:
+        records = [dict(element, region=region) for element in elements_fixture()]
+        snapshot = Snapshot('nodes', region, records)
+        snapshot.build_indexes(['group', 'id'])
+        snapshots.append(snapshot)
+
+    for args in [{}, {'group': 'www'}, {'substring.name': 'bee'},
+                 {'tags.environment': 'production'}]:
+        plan = compile_filters(werkzeug.datastructures.ImmutableMultiDict(args))
+        nodes = FilteredElements(plan, snapshots)
+        for group in [None, 'www', 'None', 'missing']:
+            scanned = sort_by_group(list(nodes), group=group)
+            assert sort_by_group(nodes, group=group) == scanned
+            assert count_by_group(nodes, group=group) == dict(
+                (name, len(members))
+                for name, members in scanned.items() if members)
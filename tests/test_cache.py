@@ -0,0 +1,113 @@
+import gevent
+
+from app.cache import ResultCache
+from app.cache import SingleFlight
+from app.cache import cache_function
+from app.cache import cache_stats
+from app.pool import ResourcePool
+
+
+def test_cache_function_counts_hits_and_misses():
+    calls = []
+
+    @cache_function(max_size=4, expiration=60)
+    def lookup_in_region(region):
+        calls.append(region)
+        return [region]
+
+    assert lookup_in_region('us-east-1') == ['us-east-1']
+    assert lookup_in_region('us-east-1') == ['us-east-1']
+    assert lookup_in_region('us-west-1') == ['us-west-1']
+    assert calls == ['us-east-1', 'us-west-1']
+
+    stats = cache_stats()['lookup_in_region']
+    assert stats['hits'] == 1
+    assert stats['misses'] == 2
+    assert stats['size'] == 2
+
+
+def test_resource_pool_reuses_per_region():
+    pool = ResourcePool(max_size=1)
+    with pool.client('rds', 'us-east-1') as first:
+        pass
+    with pool.client('rds', 'us-east-1') as second:
+        assert second is first
+        with pool.client('rds', 'us-east-1') as third:
+            assert third is not first
+    with pool.client('rds', 'us-west-1') as other:
+        assert other is not first
+
+    stats = pool.stats()
+    assert stats['created'] == 3
+    assert stats['reused'] == 1
+    assert stats['idle'] == 2
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    flight = SingleFlight()
+    calls = []
+
+    def fetch(region):
+        calls.append(region)
+        gevent.sleep(0.01)
+        return [region]
+
+    greenlets = [gevent.spawn(flight.do, 'us-east-1', fetch, 'us-east-1')
+                 for _ in range(5)]
+    gevent.joinall(greenlets)
+
+    assert [greenlet.get() for greenlet in greenlets] == [['us-east-1']] * 5
+    assert calls == ['us-east-1']
+    assert flight.stats() == {'calls': 1, 'coalesced': 4, 'in_flight': 0}
+
+
+def test_single_flight_shares_exceptions():
+    flight = SingleFlight()
+
+    def fetch():
+        gevent.sleep(0.01)
+        raise RuntimeError('throttled')
+
+    greenlets = [gevent.spawn(flight.do, 'key', fetch) for _ in range(3)]
+    gevent.joinall(greenlets)
+
+    assert all(isinstance(greenlet.exception, RuntimeError)
+               for greenlet in greenlets)
+    assert flight.calls == 1
+    assert not flight.in_flight('key')
+
+
+def test_result_cache_bounds():
+    cache = ResultCache(max_size=2, max_weight=10)
+    built = []
+
+    def build(key, weight):
+        def build():
+            built.append(key)
+            return key.upper(), weight
+        return build
+
+    assert cache.get('a', build('a', 4)) == 'A'
+    assert cache.get('a', build('a', 4)) == 'A'
+    cache.get('b', build('b', 4))
+    cache.get('a', build('a', 4))
+    cache.get('c', build('c', 4))
+    assert built == ['a', 'b', 'c']
+
+    # b was least recently used, so it was evicted to make room for c
+    cache.get('b', build('b', 4))
+    assert built == ['a', 'b', 'c', 'b']
+
+    # too heavy to cache at all
+    assert cache.get('d', build('d', 11)) == 'D'
+    cache.get('d', build('d', 11))
+    assert built.count('d') == 2
+
+    # evicts by weight as well as by number of entries
+    cache.get('e', build('e', 9))
+    stats = cache.stats()
+    assert stats['size'] == 1
+    assert stats['elements'] == 9
+    assert stats['hits'] == 2
+    assert stats['misses'] == 7
+    assert stats['hit_rate'] == 2 / 9.0
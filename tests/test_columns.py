@@ -0,0 +1,78 @@
+import itertools
+
+import pytest
+import werkzeug
+
+from app.filters import FilteredElements
+from app.filters import compile_filters
+from app.filters import filter_elements
+from app.snapshots import Snapshot
+from tests.test_filters import elements_fixture
+
+numpy = pytest.importorskip('numpy')
+
+
+def snapshot_fixture(monkeypatch):
+    monkeypatch.setattr('app.config.Config.COLUMNAR_FILTERS', True)
+    elements = elements_fixture()
+    elements.append(dict(elements[0],
+                         id=u'i-caf\xe9',
+                         group=u'caf\xe9',
+                         image_name='BaseAMI',
+                         name=u'caf\xe9-i-1',
+                         tags={'apps': u'caf\xe9,www', 'environment': ''}))
+    elements.append({'id': 'i-bare', 'name': '', 'tags': {}})
+    snapshot = Snapshot('nodes', 'us-east-1', elements)
+    assert snapshot.columns is not None
+    return snapshot
+
+
+def test_columnar_filters_match_scan(monkeypatch):
+    snapshot = snapshot_fixture(monkeypatch)
+    filters = [
+        ('group', ['www', u'caf\xe9', '']),
+        ('vpc_id', ['vpc-8675309', '']),
+        ('image_name', ['BaseAMI', '']),
+        ('is-null.vpc_id', ['']),
+        ('is-null.image_name', ['']),
+        ('in-list.instance_class', ['m1,m4', 'm4,', 't2']),
+        ('not-in-list.instance_class', ['m1,t2', '']),
+        ('in-list.group', [u'caf\xe9,www']),
+        ('starts-with.name', ['www', u'caf', '']),
+        ('not-starts-with.name', ['www']),
+        ('ends-with.name', ['efgh', u'\xe9-i-1']),
+        ('not-ends-with.name', ['efgh']),
+        ('substring.name', ['-i-', u'\xe9', '']),
+        ('not-substring.name', ['bee', '']),
+        ('tags.environment', ['production', '']),
+        ('tags.substring.environment', ['ing']),
+        ('tags.not-substring.environment', ['prod']),
+        ('tags.starts-with.environment', ['prod']),
+        ('tags.not-ends-with.environment', ['tion']),
+        ('tags.in-list.apps', ['www', u'caf\xe9', 'api,www', '']),
+        ('tags.not-in-list.apps', ['www']),
+        ('tags.is-null.UbuntuVersion', ['']),
+        ('tags.is-true.provisioned', ['']),
+        ('tags.is-false.provisioned', ['']),
+    ]
+    single = [{key: value} for key, values in filters for value in values]
+    pairs = [dict(a.items() + b.items())
+             for a, b in itertools.combinations(single, 2)]
+
+    for args in single + pairs:
+        args = werkzeug.datastructures.ImmutableMultiDict(args)
+        plan = compile_filters(args)
+        columnar = list(FilteredElements(plan, [snapshot]))
+        assert columnar == filter_elements(snapshot.records, args), args
+
+
+def test_columnar_filters_replace_tests(monkeypatch):
+    snapshot = snapshot_fixture(monkeypatch)
+    plan = compile_filters(werkzeug.datastructures.ImmutableMultiDict({
+        'starts-with.name': 'www',
+        'tags.in-list.apps': 'api',
+        'tags.substring.provisioned': 'yes',
+    }))
+    positions, tests = plan.plan(snapshot.indexes, snapshot.columns)
+    assert positions == [0]
+    assert len(tests) == 1
@@ -0,0 +1,66 @@
+import zlib
+
+import pytest
+from werkzeug.datastructures import Accept
+from werkzeug.http import parse_accept_header
+
+from app.compression import DeflatedFragment
+from app.compression import PrecompressedBodies
+from app.compression import compress
+from app.compression import crc32_combine
+from app.compression import iter_gzip
+from app.compression import negotiate
+
+
+def gunzip(chunks):
+    return zlib.decompress(''.join(chunks), 16 + zlib.MAX_WBITS)
+
+
+def test_crc32_combine():
+    for first, second in [('', ''), ('haldane', ''), ('', 'haldane'),
+                          ('{"nodes": ', '[1, 2, 3]' * 1000)]:
+        assert crc32_combine(zlib.crc32(first),
+                             zlib.crc32(second),
+                             len(second)) == zlib.crc32(first + second) & 0xffffffff
+
+
+def test_iter_gzip_splices_deflated_fragments():
+    fragment = DeflatedFragment(['[', '"www-1", ' * 500, '"www-2"]'])
+    chunks = ['{"meta": {}, "nodes": ', fragment, ', "total": ', fragment, '}']
+    expected = '{"meta": {}, "nodes": [' + '"www-1", ' * 500 + '"www-2"]'
+    expected = expected + ', "total": ' + expected[len('{"meta": {}, "nodes": '):] + '}'
+    assert gunzip(iter_gzip(chunks)) == expected
+    assert gunzip(iter_gzip([fragment])) == '[' + '"www-1", ' * 500 + '"www-2"]'
+    assert gunzip(iter_gzip([])) == ''
+
+
+def test_brotli():
+    brotli = pytest.importorskip('brotli')
+    chunks = ['{"nodes": ', '[1, 2, 3]' * 1000, '}']
+    assert brotli.decompress(''.join(compress(chunks, 'br'))) == ''.join(chunks)
+
+
+def test_negotiate():
+    def accept(header):
+        return parse_accept_header(header, Accept)
+
+    assert negotiate(accept(''), ['gzip']) is None
+    assert negotiate(accept('gzip, deflate'), ['gzip']) == 'gzip'
+    assert negotiate(accept('gzip;q=0'), ['gzip']) is None
+    assert negotiate(accept('*'), ['gzip']) == 'gzip'
+    assert negotiate(accept('identity'), ['gzip']) is None
+
+
+def test_precompressed_bodies():
+    built = []
+
+    def build():
+        built.append(True)
+        return ['[1, 2, 3]']
+
+    bodies = PrecompressedBodies(max_size=2)
+    first = bodies.get(('nodes', 'v1'), build)
+    assert bodies.get(('nodes', 'v1'), build) is first
+    bodies.get(('nodes', 'v2'), build)
+    assert len(built) == 2
+    assert bodies.stats() == {'hits': 1, 'misses': 2, 'size': 2}
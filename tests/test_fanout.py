@@ -0,0 +1,72 @@
+import gevent
+import pytest
+
+from app.fanout import RegionTimeout
+from app.fanout import fan_out
+
+
+def test_fan_out_preserves_region_order():
+    delays = {'us-east-1': 0.03, 'us-west-1': 0.0, 'eu-west-1': 0.01}
+
+    def fetch(region):
+        gevent.sleep(delays[region])
+        return region
+
+    regions = ['us-east-1', 'us-west-1', 'eu-west-1']
+    results, timings = fan_out(fetch, regions)
+    assert results == regions
+    assert sorted(timings.keys()) == sorted(regions)
+    assert timings['us-east-1'] >= 0.03
+
+
+def test_fan_out_runs_regions_concurrently():
+    def fetch(region):
+        gevent.sleep(0.05)
+        return region
+
+    regions = ['a', 'b', 'c', 'd']
+    results, timings = fan_out(fetch, regions, concurrency=4, timeout=0)
+    assert results == regions
+    assert max(timings.values()) < 0.05 * len(regions)
+
+
+def test_fan_out_concurrency_cap():
+    running = []
+    peak = []
+
+    def fetch(region):
+        running.append(region)
+        peak.append(len(running))
+        gevent.sleep(0.01)
+        running.remove(region)
+        return region
+
+    fan_out(fetch, ['a', 'b', 'c', 'd', 'e'], concurrency=2, timeout=0)
+    assert max(peak) == 2
+
+
+def test_fan_out_timeout():
+    def fetch(region):
+        if region == 'slow':
+            gevent.sleep(1)
+        return region
+
+    with pytest.raises(RegionTimeout) as excinfo:
+        fan_out(fetch, ['fast', 'slow'], timeout=0.01)
+    assert excinfo.value.region == 'slow'
+
+
+def test_fan_out_returns_exceptions():
+    def fetch(region):
+        if region == 'slow':
+            gevent.sleep(1)
+        if region == 'broken':
+            raise RuntimeError('throttled')
+        return region
+
+    results, timings = fan_out(fetch, ['fast', 'slow', 'broken'],
+                               timeout=0.01,
+                               return_exceptions=True)
+    assert results[0] == 'fast'
+    assert isinstance(results[1], RegionTimeout)
+    assert isinstance(results[2], RuntimeError)
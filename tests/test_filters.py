@@ -1,8 +1,14 @@
 import werkzeug
 
+from app.filters import FilteredElements
+from app.filters import build_index
+from app.filters import compile_filters
 from app.filters import filter_elements
+from app.filters import filter_by_args
 from app.filters import filter_by_tags
 from app.filters import get_filter
+from app.search import build_search_index
+from app.snapshots import Snapshot
 
 
 def test_filter_elements():
@@ -100,6 +106,128 @@ def test_filter_by_tags_negated():
     assert len(filtered) == 1
 
 
+def test_filter_by_args():
+    elements = elements_fixture()
+    filtered = filter_by_args(elements, {'group': 'www'})
+    assert [e['id'] for e in filtered] == ['i-abcdefgh']
+    filtered = filter_by_args(elements, {'elastic_ip': 'false'})
+    assert len(filtered) == 2
+    filtered = filter_by_args(elements, {'exact.elastic_ip': 'false'})
+    assert len(filtered) == 0
+    filtered = filter_by_args(elements, {'in-list.instance_class': 'm1,t2'})
+    assert [e['id'] for e in filtered] == ['i-stuvwxyz']
+    filtered = filter_by_args(elements, {'not-in-list.instance_class': 'm1,t2'})
+    assert [e['id'] for e in filtered] == ['i-abcdefgh']
+    filtered = filter_by_args(elements, {'starts-with.name': 'www', 'ends-with.name': 'efgh'})
+    assert [e['id'] for e in filtered] == ['i-abcdefgh']
+    filtered = filter_by_args(elements, {'substring.unknown_key': 'www', 'limit': '1'})
+    assert len(filtered) == 2
+
+
+def test_compile_filters():
+    args = werkzeug.datastructures.ImmutableMultiDict({
+        'not-substring.name': 'api',
+        'tags.environment': 'production',
+        'starts-with.name': 'www',
+        'status': 'running',
+        'fields': 'id,name',
+    })
+    plan = compile_filters(args, query='www')
+    assert [(p.filter_name, p.key, p.tag) for p in plan.predicates] == [
+        ('exact', 'status', False),
+        ('exact', 'environment', True),
+        ('starts-with', 'name', False),
+        ('substring', 'name', False),
+        ('not-substring', 'name', False),
+    ]
+    assert [e['id'] for e in plan.filter(elements_fixture())] == ['i-abcdefgh']
+
+
+def test_indexed_filters_match_scan():
+    elements = elements_fixture()
+    indexes = {
+        (False, 'group'): build_index(elements, 'group'),
+        (False, 'id'): build_index(elements, 'id'),
+        (False, 'instance_class'): build_index(elements, 'instance_class'),
+        (False, 'vpc_id'): build_index(elements, 'vpc_id'),
+        (True, 'environment'): build_index(elements, 'environment', tag=True),
+    }
+    for args in [
+        {'group': 'www'},
+        {'group': ''},
+        {'id': 'i-stuvwxyz', 'substring.name': 'bee'},
+        {'in-list.instance_class': 'm1,m4,', 'is-null.vpc_id': ''},
+        {'in-list.id': 'i-abcdefgh,i-missing', 'group': 'www'},
+        {'vpc_id': 'vpc-8675309', 'tags.environment': 'production'},
+        {'tags.environment': 'staging', 'not-starts-with.name': 'www'},
+        {'elastic_ip': 'false', 'instance_class': 'm4'},
+    ]:
+        plan = compile_filters(werkzeug.datastructures.ImmutableMultiDict(args))
+        scanned = plan.filter(elements)
+        assert plan.filter(elements, indexes) == scanned
+
+
+def test_filtered_elements_iter_ordered():
+    snapshots = []
+    for region in ['us-west-1', 'us-east-1']:
+        records = [dict(element, region=region) for element in elements_fixture()]
+        snapshot = Snapshot('nodes', region, records)
+        snapshot.build_indexes(['group'])
+        snapshots.append(snapshot)
+
+    for args in [{}, {'group': 'www'}, {'not-starts-with.name': 'www'}]:
+        plan = compile_filters(werkzeug.datastructures.ImmutableMultiDict(args))
+        elements = FilteredElements(plan, snapshots)
+        keys = sorted((e['region'], e['id']) for e in elements)
+        ordered = [(e['region'], e['id']) for e in elements.iter_ordered()]
+        assert ordered == keys
+        for i, after in enumerate(keys):
+            assert [(e['region'], e['id'])
+                    for e in elements.iter_ordered(after=after)] == keys[i + 1:]
+
+
+def test_build_index_skips_unhashable_values():
+    elements = [{'vpc_security_groups': [{'status': 'active'}]}]
+    assert build_index(elements, 'vpc_security_groups') is None
+    assert build_index(elements, 'status') == {'': frozenset([0])}
+
+
+def test_search_indexes_match_scan():
+    records = elements_fixture()
+    for i, name in enumerate(['www-1', 'www-10', 'www-2', 'api-www',
+                              u'caf\xe9-www', u'caf\xe9', '', None, 'w']):
+        records.append(dict(records[i % 2],
+                            id='i-{0}'.format(i),
+                            name=name,
+                            image_name=name,
+                            tags={'role': name}))
+    snapshot = Snapshot('nodes', 'us-east-1', records)
+    snapshot.columns = None
+    snapshot.build_search_indexes(['name', 'image_name'], ['role'])
+
+    for filter_name in ['starts-with', 'ends-with', 'substring']:
+        for key in ['name', 'image_name', 'tags.' + filter_name + '.role']:
+            if not key.startswith('tags.'):
+                key = '{0}.{1}'.format(filter_name, key)
+            for value in ['', 'w', 'ww', 'www', 'www-1', '-ww', 'ww-', '0',
+                          u'\xe9', u'f\xe9-w', u'caf\xe9', 'missing']:
+                args = werkzeug.datastructures.ImmutableMultiDict({key: value})
+                plan = compile_filters(args)
+                positions, tests = plan.plan(search_indexes=snapshot.search_indexes)
+                if filter_name != 'substring' or len(value.encode('utf-8')) >= 3:
+                    assert positions is not None and not tests, args
+                searched = list(FilteredElements(plan, [snapshot]))
+                assert searched == plan.filter(snapshot.records), args
+
+
+def test_build_search_index_skips_non_strings():
+    elements = [{'name': 'www', 'tags': {'count': 1}}, {'name': False}]
+    assert build_search_index(elements, 'count', tag=True) is None
+    index = build_search_index(elements, 'name')
+    assert index.lookup('starts-with', 'w') == frozenset([0])
+    assert index.lookup('substring', 'ww') is None
+
+
 def elements_fixture():
     return [
         {
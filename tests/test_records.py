@@ -0,0 +1,91 @@
+import json
+import pickle
+
+import pytest
+
+from app.records import FrozenRecord
+from app.records import Interner
+from app.records import freeze
+from app.records import make_record
+from app.records import project
+from app.utils import sorted_json
+
+
+def record_fixture():
+    return {
+        'group': None,
+        'id': 'i-1',
+        'name': 'www-1',
+        'tags': {'Name': 'www-1', 'aws:autoscaling:groupName': 'www'},
+        'security_groups': [{'id': 'sg-1'}],
+    }
+
+
+def test_record_reads_like_a_dict():
+    data = record_fixture()
+    record = make_record(data)
+
+    assert record['name'] == 'www-1'
+    assert record.get('group', 'default') is None
+    assert record.get('missing', 'default') == 'default'
+    assert 'tags' in record and 'missing' not in record
+    assert sorted(record) == sorted(data)
+    assert len(record) == len(data)
+    assert dict(record.items()) == record.to_dict()
+    assert record == freeze(data) and not record != freeze(data)
+    assert record == make_record(data)
+    assert record != make_record(dict(data, name='www-2'))
+    with pytest.raises(KeyError):
+        record['missing']
+
+
+def test_record_is_immutable_and_compact():
+    record = make_record(record_fixture())
+    assert isinstance(record['tags'], FrozenRecord)
+    assert record['security_groups'] == ({'id': 'sg-1'},)
+    with pytest.raises(TypeError):
+        record['tags']['Name'] = 'db-1'
+    with pytest.raises(AttributeError):
+        record.__dict__
+
+    other = make_record(dict(record_fixture(), id='i-2'))
+    assert type(other) is type(record)
+
+
+def test_record_serializes_to_its_dict_shape():
+    data = record_fixture()
+    record = make_record(data)
+
+    assert sorted_json(record) == sorted_json(data)
+    assert record.to_json(1) == sorted_json(data).replace('\n', '\n  ')
+    assert json.loads(record.to_json(pretty=False)) == data
+    assert pickle.loads(pickle.dumps(record)) == record
+    assert project(record, ['id', 'missing']) == {'id': 'i-1'}
+
+
+def test_interner_shares_repeated_strings_and_tag_sets():
+    interner = Interner()
+    records = [make_record({'id': 'i-{0}'.format(i),
+                            'instance_type': ''.join(['m4.', 'large']),
+                            'tags': {'team': ''.join(['web']), 'spot': i == 2}},
+                           interner)
+               for i in range(3)]
+
+    assert records[0]['instance_type'] is records[1]['instance_type']
+    assert records[0]['tags'] is records[1]['tags']
+    assert records[2]['tags'] is not records[0]['tags']
+    assert records[2]['tags']['team'] is records[0]['tags']['team']
+    assert records[2] == {'id': 'i-2',
+                          'instance_type': 'm4.large',
+                          'tags': {'team': 'web', 'spot': True}}
+
+    stats = interner.stats()
+    assert stats['mappings'] == {'distinct': 2, 'ratio': 1.5, 'total': 3}
+    assert stats['strings']['distinct'] == 7
+    assert stats['strings']['total'] == 15
+
+
+def test_interner_tells_true_from_one():
+    interner = Interner()
+    assert freeze({'a': True}, interner)['a'] is True
+    assert type(freeze({'a': 1}, interner)['a']) is int
@@ -0,0 +1,325 @@
+import time
+
+import gevent
+import pytest
+
+from app.snapshots import SharedSnapshots
+from app.snapshots import Snapshot
+from app.snapshots import SnapshotStore
+
+
+def store_fixture(calls, refresh_interval=60, max_staleness=600):
+    def fetch_nodes(region):
+        calls.append(region)
+        return [{'id': 'i-{0}'.format(len(calls)), 'region': region}]
+
+    return SnapshotStore({'nodes': fetch_nodes},
+                         refresh_interval=refresh_interval,
+                         max_staleness=max_staleness)
+
+
+def test_snapshot_store_serves_cached_snapshot():
+    calls = []
+    store = store_fixture(calls)
+    first = store.get('nodes', 'us-east-1')
+    second = store.get('nodes', 'us-east-1')
+    assert first is second
+    assert calls == ['us-east-1']
+    assert store.stats()['hits'] == 1
+    assert store.stats()['misses'] == 1
+
+
+def test_snapshot_store_serves_stale_while_refreshing():
+    calls = []
+    store = store_fixture(calls)
+    first = store.get('nodes', 'us-east-1')
+    first.fetched_at -= 120
+
+    stale = store.get('nodes', 'us-east-1')
+    assert stale is first
+    assert store.stats()['snapshots']['nodes']['us-east-1']['refreshing']
+
+    store.refresh_async('nodes', 'us-east-1').join()
+    fresh = store.get('nodes', 'us-east-1')
+    assert fresh is not first
+    assert fresh.records[0]['id'] == 'i-2'
+    assert store.stats()['stale_hits'] == 1
+
+
+def test_snapshot_store_refetches_past_max_staleness():
+    calls = []
+    store = store_fixture(calls)
+    first = store.get('nodes', 'us-east-1')
+    first.fetched_at -= 1200
+
+    fresh = store.get('nodes', 'us-east-1')
+    assert fresh is not first
+    assert calls == ['us-east-1', 'us-east-1']
+
+
+def test_snapshot_store_keeps_last_good_snapshot_on_failure():
+    calls = []
+    store = store_fixture(calls)
+    first = store.get('nodes', 'us-east-1')
+    first.fetched_at -= 120
+
+    def failing_fetch(region):
+        raise RuntimeError('throttled')
+
+    store.fetchers['nodes'] = failing_fetch
+    store.refresh_async('nodes', 'us-east-1').join()
+    assert store.get('nodes', 'us-east-1') is first
+
+
+def test_snapshot_store_serves_failing_regions_stale():
+    calls = []
+    store = store_fixture(calls)
+    east = store.get('nodes', 'us-east-1')
+    west = store.get('nodes', 'us-west-1')
+    east.fetched_at -= 1200
+    west.fetched_at -= 1200
+
+    def fetch_nodes(region):
+        calls.append(region)
+        if region == 'us-west-1':
+            raise RuntimeError('throttled')
+        return []
+
+    store.fetchers['nodes'] = fetch_nodes
+    assert store.get('nodes', 'us-east-1') is not east
+    assert store.get('nodes', 'us-west-1') is west
+    assert store.error('nodes', 'us-east-1') is None
+    assert store.error('nodes', 'us-west-1')['error'] == 'throttled'
+
+    # later requests are not held up by the failing region
+    assert store.get('nodes', 'us-west-1') is west
+    assert calls == ['us-east-1', 'us-west-1', 'us-east-1', 'us-west-1']
+    store.refresh_async('nodes', 'us-west-1').join()
+    assert calls[4:] == ['us-west-1']
+    assert store.stats()['failed_hits'] == 2
+
+    store.fetchers['nodes'] = lambda region: []
+    assert store.refresh('nodes', 'us-west-1', force=True) is not west
+    assert store.error('nodes', 'us-west-1') is None
+
+
+def test_snapshot_store_fetch_outlives_a_timed_out_caller():
+    calls = []
+
+    def fetch_nodes(region):
+        calls.append(region)
+        gevent.sleep(0.02)
+        return [{'id': 'i-1'}]
+
+    store = SnapshotStore({'nodes': fetch_nodes})
+    with pytest.raises(gevent.Timeout):
+        with gevent.Timeout(0.005):
+            store.get('nodes', 'us-east-1')
+
+    snapshot = store.get('nodes', 'us-east-1')
+    assert snapshot.records[0]['id'] == 'i-1'
+    assert calls == ['us-east-1']
+
+
+def test_snapshot_store_forced_refresh_joins_refresh_in_flight():
+    calls = []
+
+    def fetch_nodes(region):
+        calls.append(region)
+        gevent.sleep(0.01)
+        return []
+
+    store = SnapshotStore({'nodes': fetch_nodes})
+    background = store.refresh_async('nodes', 'us-east-1')
+    gevent.sleep(0)
+    forced = store.refresh('nodes', 'us-east-1', force=True)
+    background.join()
+    assert forced is store.get('nodes', 'us-east-1')
+    assert calls == ['us-east-1']
+
+
+def test_snapshot_store_forced_refresh_refetches_earlier_fetches():
+    calls = []
+
+    def fetch_nodes(region):
+        calls.append(region)
+        gevent.sleep(0.01)
+        return [{'id': 'i-{0}'.format(len(calls))}]
+
+    store = SnapshotStore({'nodes': fetch_nodes})
+    background = store.refresh_async('nodes', 'us-east-1')
+    gevent.sleep(0.005)
+    forced = store.refresh('nodes', 'us-east-1', force=True)
+    background.join()
+    assert forced.records[0]['id'] == 'i-2'
+    assert calls == ['us-east-1', 'us-east-1']
+
+    def failing_fetch(region):
+        calls.append(region)
+        gevent.sleep(0.01)
+        raise RuntimeError('throttled')
+
+    store.fetchers['nodes'] = failing_fetch
+    failed_at = time.time()
+    with pytest.raises(RuntimeError):
+        store.refresh('nodes', 'us-east-1', force=True)
+    assert store.error('nodes', 'us-east-1')['failed_at'] < failed_at + 0.005
+
+
+def test_snapshot_store_scheduler_refreshes_every_region():
+    calls = []
+    store = store_fixture(calls)
+    store.start(['us-east-1', 'us-west-1'])
+    gevent.sleep(0.01)
+    store.stop()
+    assert sorted(calls) == ['us-east-1', 'us-west-1']
+
+
+def test_snapshot_store_coalesces_concurrent_misses():
+    calls = []
+
+    def fetch_nodes(region):
+        calls.append(region)
+        gevent.sleep(0.01)
+        return []
+
+    store = SnapshotStore({'nodes': fetch_nodes})
+    greenlets = [gevent.spawn(store.get, 'nodes', 'us-east-1')
+                 for _ in range(5)]
+    gevent.joinall(greenlets)
+
+    assert calls == ['us-east-1']
+    assert len(set(greenlet.get() for greenlet in greenlets)) == 1
+    assert store.stats()['coalesced'] == 4
+
+
+def test_shared_snapshots_fetch_once_across_stores(tmpdir):
+    calls = []
+    directory = str(tmpdir.join('snapshots'))
+    first = store_fixture(calls)
+    first.shared = SharedSnapshots(directory)
+    second = store_fixture(calls)
+    second.shared = SharedSnapshots(directory)
+
+    written = first.get('nodes', 'us-east-1')
+    read = second.get('nodes', 'us-east-1')
+    assert calls == ['us-east-1']
+    assert read is not written
+    assert read.records == written.records
+    assert read.fetched_at == written.fetched_at
+    assert second.shared.stats()['reads'] == 1
+    assert [path.basename for path in tmpdir.join('snapshots').listdir()
+            if path.ext == '.json'] == ['nodes.us-east-1.json']
+
+
+def test_shared_snapshots_refetch_stale_files(tmpdir):
+    calls = []
+    shared = SharedSnapshots(str(tmpdir.join('snapshots')))
+    first = store_fixture(calls)
+    first.shared = shared
+    snapshot = first.get('nodes', 'us-east-1')
+    snapshot.fetched_at -= 120
+    shared.write(snapshot)
+
+    second = store_fixture(calls)
+    second.shared = shared
+    fresh = second.get('nodes', 'us-east-1')
+    assert calls == ['us-east-1', 'us-east-1']
+    assert shared.read('nodes', 'us-east-1').fetched_at == fresh.fetched_at
+
+
+def test_shared_snapshots_forced_refresh_fetches(tmpdir):
+    calls = []
+    shared = SharedSnapshots(str(tmpdir.join('snapshots')))
+    first = store_fixture(calls)
+    first.shared = shared
+    first.get('nodes', 'us-east-1')
+
+    second = store_fixture(calls)
+    second.shared = shared
+    forced = second.refresh('nodes', 'us-east-1', force=True)
+    assert calls == ['us-east-1', 'us-east-1']
+    assert shared.read('nodes', 'us-east-1').records == forced.records
+
+
+def test_shared_snapshots_reload_when_shared_anew(tmpdir):
+    calls = []
+    directory = str(tmpdir.join('snapshots'))
+    first = store_fixture(calls)
+    first.shared = SharedSnapshots(directory)
+    second = store_fixture(calls)
+    second.shared = SharedSnapshots(directory)
+
+    first.get('nodes', 'us-east-1')
+    read = second.get('nodes', 'us-east-1')
+    assert second.get('nodes', 'us-east-1') is read
+
+    forced = first.refresh('nodes', 'us-east-1', force=True)
+    assert second.get('nodes', 'us-east-1') is read
+    second.reload_async('nodes', 'us-east-1', None).join()
+    reloaded = second.get('nodes', 'us-east-1')
+    assert reloaded.records == forced.records != read.records
+    assert second.get('nodes', 'us-east-1') is reloaded
+    assert first.get('nodes', 'us-east-1') is forced
+    assert calls == ['us-east-1', 'us-east-1']
+    assert second.shared.stats()['reads'] == 2
+
+
+def test_shared_snapshots_serve_stale_files_on_failure(tmpdir):
+    calls = []
+    shared = SharedSnapshots(str(tmpdir.join('snapshots')))
+    first = store_fixture(calls)
+    first.shared = shared
+    written = first.get('nodes', 'us-east-1')
+    written.fetched_at -= 1200
+    shared.write(written)
+
+    def failing_fetch(region):
+        raise RuntimeError('throttled')
+
+    second = store_fixture(calls)
+    second.shared = shared
+    second.fetchers['nodes'] = failing_fetch
+    read = second.get('nodes', 'us-east-1')
+    assert read.records == written.records
+    assert second.error('nodes', 'us-east-1')['error'] == 'throttled'
+
+    forced = second.refresh('nodes', 'us-east-1', force=True)
+    assert forced is read
+
+
+def test_shared_snapshots_ignore_other_formats(tmpdir):
+    shared = SharedSnapshots(str(tmpdir))
+    tmpdir.join('nodes.us-east-1.json').write('{"format_version": 0}')
+    assert shared.read('nodes', 'us-east-1') is None
+    tmpdir.join('nodes.us-east-1.json').write('{')
+    assert shared.read('nodes', 'us-east-1') is None
+    assert shared.stats()['errors'] == 1
+
+
+def test_shared_snapshots_refuse_open_directories(tmpdir):
+    calls = []
+    directory = tmpdir.join('snapshots')
+    directory.mkdir().chmod(0o777)
+    store = store_fixture(calls)
+    store.shared = SharedSnapshots(str(directory))
+
+    store.get('nodes', 'us-east-1')
+    assert calls == ['us-east-1']
+    assert not store.shared.usable()
+    assert directory.listdir() == []
+
+    directory.chmod(0o700)
+    assert SharedSnapshots(str(directory.join('nested'))).usable()
+    assert SharedSnapshots(str(directory)).usable()
+
+
+def test_snapshot_index_by_is_built_once():
+    snapshot = Snapshot('amis', 'us-east-1', [
+        {'id': 'ami-1234abcd', 'name': 'BaseAMI'},
+        {'id': 'ami-wxyz7890', 'name': 'WebAMI'},
+    ])
+    index = snapshot.index_by('id')
+    assert index['ami-wxyz7890']['name'] == 'WebAMI'
+    assert index.get('ami-missing') is None
+    assert snapshot.index_by('id') is index
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+import json
+
+from app.records import freeze
+from app.utils import iter_csv
+from app.utils import render_json
+from app.utils import sorted_json
+
+
+def records_fixture():
+    return [freeze({
+        'block_device_mapping': {'/dev/sda1': {'volume_size': 8}},
+        'empty': {},
+        'id': 'i-{0}'.format(i),
+        'ip': None,
+        'launch_time': 1472331480.5,
+        'name': u'www-{0}-\xe9'.format(i),
+        'product_codes': [],
+        'security_groups': [{'id': 'sg-1'}, {'id': 'sg-2'}],
+        'tags': {'Name': 'www', 'enabled': True},
+    }) for i in range(3)]
+
+
+def test_render_json_matches_sorted_json():
+    records = records_fixture()
+    projected = [{'id': record['id'], 'tags': record['tags']}
+                 for record in records]
+    documents = [
+        {'meta': {'regions': ['us-east-1'], 'total': 3}, 'nodes': records},
+        {'nodes': dict((record['id'], record) for record in records)},
+        {'groups': {'www': records, 'None': []}},
+        {'groups': {'www': dict((r['id'], r) for r in records)}},
+        {'nodes': projected},
+        {'nodes': []},
+        records,
+        records[0],
+        {1: records[0]},
+    ]
+    for document in documents:
+        expected = json.dumps(document,
+                              sort_keys=True,
+                              indent=2,
+                              separators=(',', ': '))
+        assert sorted_json(document) == expected
+        assert render_json(document) == expected
+
+        expected = json.dumps(document, sort_keys=True, separators=(',', ':'))
+        assert sorted_json(document, pretty=False) == expected
+        assert render_json(document, pretty=False) == expected
+
+
+def test_render_json_reuses_record_fragments():
+    record = records_fixture()[0]
+    first = render_json({'nodes': [record]})
+    assert record.to_json(2) is record.to_json(2)
+    assert render_json({'nodes': [record]}) == first
+    assert record.to_json(pretty=False) is record.to_json(3, pretty=False)
+
+
+def test_iter_csv():
+    elements = [
+        {'id': 'i-1', 'name': u'www, \xe9', 'ip': None, 'tags': {'a': '"b"'}},
+        {'id': 'i-2', 'name': 'db', 'ip': '10.0.0.1', 'tags': {}},
+    ]
+    rows = list(iter_csv(elements, ['id', 'name', 'ip', 'tag:a', 'tags']))
+    assert rows == [
+        'id,name,ip,tag:a,tags\r\n',
+        'i-1,"www, \xc3\xa9",,"""b""","{""a"":""\\""b\\""""}"\r\n',
+        'i-2,db,10.0.0.1,,{}\r\n',
+    ]
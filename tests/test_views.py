@@ -0,0 +1,343 @@
+import base64
+import json
+import zlib
+
+import pytest
+
+from app import make_application
+from app import aws
+from app import views
+from app.cache import ResultCache
+from app.compression import PrecompressedBodies
+from app.config import Config
+from app.filters import FilterPlan
+
+
+def nodes_fixture(region):
+    return [
+        {
+            'group': 'www',
+            'id': 'i-{0}-1'.format(region),
+            'name': 'www-1-{0}'.format(region),
+            'region': region,
+            'status': 'running',
+            'tags': {'Name': 'www-1', 'environment': 'production'},
+        },
+        {
+            'group': None,
+            'id': 'i-{0}-2'.format(region),
+            'name': 'db-1-{0}'.format(region),
+            'region': region,
+            'status': 'stopped',
+            'tags': {'Name': 'db-1', 'environment': 'staging'},
+        },
+    ]
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(Config, 'AWS_REGIONS', ['us-east-1', 'us-west-1'])
+    monkeypatch.setattr(Config, 'BASIC_AUTH', None)
+    monkeypatch.setattr(Config, 'SNAPSHOT_BACKGROUND_REFRESH', False)
+    monkeypatch.setattr(aws.snapshot_store, 'shared', None)
+    monkeypatch.setattr(aws.snapshot_store, 'fetchers', {'nodes': nodes_fixture})
+    monkeypatch.setattr(aws.snapshot_store, '_snapshots', {})
+    monkeypatch.setattr(aws.snapshot_store, '_failures', {})
+    monkeypatch.setattr(views, 'precompressed_bodies', PrecompressedBodies())
+    monkeypatch.setattr(views, 'result_cache', ResultCache())
+
+    test_client = make_application().test_client()
+
+    def get(url, headers=None, method='GET'):
+        response = test_client.open(url,
+                                    method=method,
+                                    headers=headers,
+                                    environ_base={'SERVER_SOFTWARE': 'test'})
+        body = response.get_data()
+        if response.content_encoding == 'gzip':
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        if response.mimetype == 'application/json' and body:
+            return response, json.loads(body)
+        return response, body
+
+    return get
+
+
+def test_fields_do_not_modify_cached_records(client):
+    response, body = client('/instances?fields=id')
+    assert response.status_code == 200
+    assert body['nodes']['www-1-us-east-1'] == {'id': 'i-us-east-1-1'}
+
+    response, body = client('/instances')
+    node = body['nodes']['www-1-us-east-1']
+    assert node['name'] == 'www-1-us-east-1'
+    assert node['tags'] == {'Name': 'www-1', 'environment': 'production'}
+
+    response, body = client('/instances/group?fields=id&format=list')
+    assert body['groups']['www'] == [{'id': 'i-us-east-1-1'},
+                                     {'id': 'i-us-west-1-1'}]
+
+    snapshot = aws.snapshot_store.get('nodes', 'us-east-1')
+    assert snapshot.records[0]['name'] == 'www-1-us-east-1'
+
+
+def test_compact_responses(client):
+    response, body = client('/instances')
+    assert response.get_data().startswith('{\n  "meta"')
+
+    for url, headers in [
+            ('/instances?pretty=false', None),
+            ('/instances', {'Accept': 'application/json; pretty=false'}),
+            ('/instances', {'Accept': 'text/html, application/json;pretty=0'})]:
+        compact, compact_body = client(url, headers=headers)
+        assert '\n' not in compact.get_data()
+        assert compact.get_data().startswith('{"meta":')
+        assert compact_body['nodes'] == body['nodes']
+        assert 'Accept' in compact.headers['Vary']
+
+
+def test_streamed_responses(client):
+    response, body = client('/instances?format=list')
+
+    response, lines = client('/instances?format=ndjson')
+    assert response.mimetype == 'application/x-ndjson'
+    assert [json.loads(line) for line in lines.splitlines()] == body['nodes']
+
+    response, lines = client('/instances?format=csv&fields=id,tag:environment')
+    assert response.mimetype == 'text/csv'
+    assert lines.splitlines() == [
+        'id,tag:environment',
+        'i-us-east-1-2,staging',
+        'i-us-west-1-2,staging',
+        'i-us-east-1-1,production',
+        'i-us-west-1-1,production',
+    ]
+
+    response, lines = client('/instances?format=csv&flatten_tags=true&limit=1')
+    assert lines.splitlines() == [
+        'group,id,name,region,status,tag:Name,tag:environment',
+        'www,i-us-east-1-1,www-1-us-east-1,us-east-1,running,www-1,production',
+    ]
+
+
+def test_csv_columns_cover_every_element():
+    elements = [
+        {'id': 'db-1', 'tags': {'environment': 'production'}},
+        {'id': 'db-2', 'endpoint': 'db-2.rds', 'tags': {'team': 'data'}},
+    ]
+    assert views.csv_columns(elements) == ['endpoint', 'id', 'tags']
+    assert views.csv_columns(elements, flatten_tags=True) == [
+        'endpoint', 'id', 'tag:environment', 'tag:team']
+    assert views.csv_columns(elements, fields='id,endpoint') == ['id', 'endpoint']
+    assert views.csv_columns([]) == []
+
+
+def test_gzip_responses(client):
+    gzip = {'Accept-Encoding': 'gzip'}
+    response, body = client('/instances?format=list')
+    assert response.content_encoding is None
+    assert 'Accept-Encoding' in response.headers['Vary']
+
+    for _ in range(2):
+        compressed, compressed_body = client('/instances?format=list',
+                                             headers=gzip)
+        assert compressed.content_encoding == 'gzip'
+        assert compressed_body['nodes'] == body['nodes']
+    assert views.precompressed_bodies.stats()['hits'] == 1
+
+    compressed, compressed_body = client('/instances?status=running',
+                                         headers=gzip)
+    assert compressed.content_encoding == 'gzip'
+    assert sorted(compressed_body['nodes']) == ['www-1-us-east-1',
+                                                'www-1-us-west-1']
+    assert views.precompressed_bodies.stats()['misses'] == 1
+
+    aws.snapshot_store.get('nodes', 'us-east-1').fetched_at -= 1000
+    compressed, compressed_body = client('/instances?format=list',
+                                         headers=gzip)
+    assert compressed_body['nodes'] == body['nodes']
+    assert views.precompressed_bodies.stats()['hits'] == 2
+
+    aws.snapshot_store.fetchers['nodes'] = lambda region: nodes_fixture(region)[:1]
+    aws.snapshot_store.get('nodes', 'us-east-1').fetched_at -= 1000
+    compressed, compressed_body = client('/instances?format=list',
+                                         headers=gzip)
+    assert len(compressed_body['nodes']) == 3
+    assert views.precompressed_bodies.stats()['misses'] == 2
+
+
+def test_conditional_responses(client, monkeypatch):
+    response, body = client('/instances?q=www&region=us-east-1')
+    etag = response.headers['ETag']
+    assert etag.startswith('W/"')
+
+    response, body = client('/instances/us-east-1?query=www')
+    assert response.headers['ETag'] == etag
+    response, body = client('/instances?query=db&region=us-east-1')
+    assert response.headers['ETag'] != etag
+
+    def plan(self, *args, **kwargs):
+        raise AssertionError('filtered a not modified listing')
+
+    original_plan = FilterPlan.plan
+    monkeypatch.setattr(FilterPlan, 'plan', plan)
+    response, body = client('/instances/us-east-1?q=www',
+                            headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+    monkeypatch.setattr(FilterPlan, 'plan', original_plan)
+
+    aws.snapshot_store.fetchers['nodes'] = lambda region: nodes_fixture(region)[1:]
+    aws.snapshot_store.get('nodes', 'us-east-1').fetched_at -= 1000
+    response, body = client('/instances/us-east-1?q=www',
+                            headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+
+def test_result_cache(client):
+    response, first = client('/instances?q=www&fields=id,name')
+    response, second = client('/instances?fields=id,name&query=www')
+    assert second['nodes'] == first['nodes']
+    assert views.result_cache.stats()['hits'] == 1
+
+    response, groups = client('/instances/group/www?fields=id')
+    response, groups = client('/instances/group/www?fields=id')
+    assert groups['groups'] == {'www': {'www-1-us-east-1': {'id': 'i-us-east-1-1'},
+                                        'www-1-us-west-1': {'id': 'i-us-west-1-1'}}}
+    assert views.result_cache.stats()['hits'] == 2
+
+    response, status = client('/_status')
+    assert status['_service']['result_cache']['hit_rate'] == 0.5
+
+
+def test_cursor_pagination(client):
+    def walk(url):
+        ids = []
+        cursor = ''
+        while True:
+            response, body = client('{0}&cursor={1}'.format(url, cursor))
+            ids.extend(node['id'] for node in body['nodes'])
+            cursor = body['meta']['next']
+            if cursor is None:
+                return ids, body['meta']
+
+    ids, meta = walk('/instances?format=list&limit=1')
+    assert ids == ['i-us-east-1-1', 'i-us-east-1-2',
+                   'i-us-west-1-1', 'i-us-west-1-2']
+    assert meta['total'] == 4
+
+    ids, meta = walk('/instances?format=list&limit=3&status=running')
+    assert ids == ['i-us-east-1-1', 'i-us-west-1-1']
+
+    response, body = client('/instances?format=list&limit=2')
+    assert [node['id'] for node in body['nodes']] == ['i-us-east-1-1',
+                                                      'i-us-east-1-2']
+    assert body['meta']['total'] == 4
+
+    response, counted = client('/instances?format=list&limit=4&count=false'
+                               '&tags.environment=production')
+    assert counted['meta']['total'] == 2
+    assert not counted['meta']['total_is_estimate']
+
+    # us-east-1 is refreshed mid-walk with a new instance sorting before the
+    # cursor, which the walk neither repeats nor goes back for
+    def fetch_nodes(region):
+        nodes = nodes_fixture(region)
+        nodes.append(dict(nodes[0], id='i-{0}-0'.format(region), name='new'))
+        return nodes
+
+    aws.snapshot_store.fetchers['nodes'] = fetch_nodes
+    aws.snapshot_store.get('nodes', 'us-east-1').fetched_at -= 1000
+    response, body = client('/instances?format=list&limit=2&cursor={0}'.format(
+        body['meta']['next']))
+    assert [node['id'] for node in body['nodes']] == ['i-us-west-1-1',
+                                                      'i-us-west-1-2']
+    assert body['meta']['cursor_is_stale']
+
+    response, body = client('/instances?limit=2&cursor=garbage')
+    assert response.status_code == 400
+
+    for limit in ('-1', 'abc', ''):
+        response, body = client('/instances?limit={0}'.format(limit))
+        assert response.status_code == 400
+
+    response, body = client('/instances?format=list&limit=0')
+    assert body['nodes'] == []
+    assert body['meta']['next'] is None
+
+
+def test_failing_regions_are_left_out(client):
+    def fetch_nodes(region):
+        if region == 'us-west-1':
+            raise RuntimeError('throttled')
+        return nodes_fixture(region)
+
+    aws.snapshot_store.fetchers['nodes'] = fetch_nodes
+    response, body = client('/instances?format=list')
+    assert response.status_code == 200
+    assert [node['region'] for node in body['nodes']] == ['us-east-1'] * 2
+    assert body['meta']['snapshot_errors']['us-west-1']['error'] == 'throttled'
+
+    response, body = client('/instances/us-west-1')
+    assert response.status_code == 500
+
+
+def test_region_refresh(client, monkeypatch):
+    response, body = client('/instances')
+    assert body['meta']['snapshot_errors'] == {}
+    west = aws.snapshot_store.get('nodes', 'us-west-1')
+
+    calls = []
+
+    def fetch_nodes(region):
+        calls.append(region)
+        if region == 'us-west-1':
+            raise RuntimeError('throttled')
+        return nodes_fixture(region)[:1]
+
+    aws.snapshot_store.fetchers['nodes'] = fetch_nodes
+    response, body = client('/_refresh', method='POST')
+    assert response.status_code == 403 and calls == []
+
+    monkeypatch.setattr(Config, 'ADMIN_AUTH', 'admin:secret')
+    monkeypatch.setattr(Config, 'ALLOWED_IPS', ['127.0.0.1'])
+    response, body = client('/_refresh', method='POST')
+    assert response.status_code == 401 and calls == []
+
+    admin = {'Authorization': 'Basic {0}'.format(
+        base64.b64encode('admin:secret'))}
+    response, body = client('/_refresh/nodes/us-east-1', headers=admin)
+    assert response.status_code != 200 and calls == []
+
+    response, body = client('/_refresh/nodes/us-east-1',
+                            headers=admin,
+                            method='POST')
+    assert response.status_code == 200
+    assert body['snapshots']['nodes']['us-east-1']['records'] == 1
+    assert calls == ['us-east-1']
+    assert aws.snapshot_store.get('nodes', 'us-west-1') is west
+
+    # a region whose refresh fails keeps being served from its last snapshot
+    response, body = client('/_refresh?region=us-west-1',
+                            headers=admin,
+                            method='POST')
+    assert response.status_code == 502
+    assert body['snapshots']['nodes']['us-west-1']['error']['error'] == 'throttled'
+    assert body['snapshots']['nodes']['us-west-1']['version'] == west.version
+
+    west.fetched_at -= 1000
+    response, body = client('/instances?format=list')
+    assert response.status_code == 200
+    assert sorted(node['id'] for node in body['nodes']) == [
+        'i-us-east-1-1', 'i-us-west-1-1', 'i-us-west-1-2']
+    assert body['meta']['snapshot_errors'].keys() == ['us-west-1']
+
+    response, body = client('/_refresh/volumes', headers=admin, method='POST')
+    assert response.status_code == 400
+
+    reader = {'Authorization': 'Basic {0}'.format(
+        base64.b64encode('reader:secret'))}
+    monkeypatch.setattr(Config, 'BASIC_AUTH', 'reader:secret')
+    response, body = client('/_refresh', headers=reader, method='POST')
+    assert response.status_code == 401